@@ -0,0 +1,12 @@
+'''
+블로그 뷰 성능 측정
+
+    python -m benchmarks.generate --posts 10000 --comments 5 --long-thread 2000
+    python -m benchmarks.run --mode wsgi --concurrency 4 --requests 500 -o before.json
+    python -m benchmarks.run --mode http --concurrency 16 --requests 2000 -o after.json
+    python -m benchmarks.compare before.json after.json
+    python -m benchmarks.dbconcurrency --readers 8 --writers 2   # SQLite PRAGMA 설정별 동시 읽기/쓰기
+
+데이터는 benchmarks/settings.py의 별도 DB(bench.sqlite3)와 업로드 폴더에 만든다.
+같은 --seed면 같은 데이터와 같은 요청 순서가 나오므로 커밋끼리 결과를 비교할 수 있다.
+'''
@@ -0,0 +1,253 @@
+import asyncio
+import http.client
+import threading
+import uuid
+from http.cookies import SimpleCookie
+from io import BytesIO
+from socketserver import ThreadingMixIn
+from urllib.parse import urlencode, urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from wsgiref.util import setup_testing_defaults
+
+
+'''
+측정 대상 WSGI 앱(myweb/wsgi.py)을 부르는 방법들.
+    WSGITransport : 같은 프로세스에서 앱을 직접 부른다. 네트워크와 HTTP 파싱 비용이 없다.
+    HTTPTransport : 같은 프로세스에 띄운 로컬 HTTP 서버(wsgiref, 요청마다 스레드)로 보낸다.
+    ASGITransport : myweb/asgi.py로 감싸 이벤트 루프 하나와 워커 스레드 풀로 부른다.
+어느 쪽이든 count_queries로 감싼 앱이 응답 헤더에 쿼리 수를 넣어준다.
+WSGI 쪽은 limit_workers로 동시에 앱을 부르는 스레드 수를 ASGI 풀 크기와 맞춰서 비교한다.
+'''
+
+QUERIES_HEADER = 'X-Bench-Queries'
+
+
+def count_queries(app):
+    '''
+    요청 하나에서 실행된 쿼리 수를 응답 헤더로 알려주는 WSGI 래퍼.
+    쿼리 수는 앱이 돌아온 뒤에야 알 수 있으므로 start_response를 그때까지 미룬다.
+    '''
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    def wrapped(environ, start_response):
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured.append((status, headers, exc_info))
+            return lambda data: None # 장고는 write()를 쓰지 않는다.
+
+        with CaptureQueriesContext(connection) as ctx:
+            body = app(environ, capture)
+        status, headers, exc_info = captured[0]
+        start_response(status, list(headers) + [(QUERIES_HEADER, str(len(ctx)))], exc_info)
+        return body
+    return wrapped
+
+
+def limit_workers(app, workers):
+    '''
+    동시에 앱 안에 있을 수 있는 요청을 workers개로 제한한다. (워커 스레드가 workers개인 WSGI 서버)
+    '''
+    slots = threading.BoundedSemaphore(workers)
+
+    def wrapped(environ, start_response):
+        with slots:
+            return app(environ, start_response)
+    return wrapped
+
+
+class Result(object):
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers # 소문자 이름 -> 값 목록
+        self.body = body
+
+    @property
+    def queries(self):
+        values = self.headers.get(QUERIES_HEADER.lower())
+        return int(values[0]) if values else None
+
+
+class WSGITransport(object):
+    def __init__(self, app):
+        self.app = app
+
+    def send(self, method, path, body, headers):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body),
+        }
+        for name, value in headers.items():
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = value
+        setup_testing_defaults(environ)
+
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = response_headers
+
+        result = self.app(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close() # request_finished signal (DB 연결 정리)
+        return Result(response['status'], _header_dict(response['headers']), content)
+
+    def close(self):
+        pass
+
+
+class ASGITransport(object):
+    def __init__(self, app, workers):
+        from myweb.asgi import ASGIApplication
+        # 측정 중에는 503으로 돌려보내지 않도록 대기열 제한은 넉넉히 둔다.
+        self.app = ASGIApplication(app, max_workers=workers, max_pending=10 ** 6)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def send(self, method, path, body, headers):
+        future = asyncio.run_coroutine_threadsafe(self._send(method, path, body, headers), self.loop)
+        return future.result()
+
+    async def _send(self, method, path, body, headers):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'query_string': query.encode('latin1'),
+            'root_path': '',
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers.items()]
+                       + [(b'content-length', str(len(body)).encode('latin1'))],
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        response = {'body': []}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait() # 스트리밍 응답이 끊김을 기다리는 경우. 측정 시나리오에는 없다.
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = [(name.decode('latin1'), value.decode('latin1')) for name, value in message['headers']]
+            else:
+                response['body'].append(message.get('body', b''))
+
+        await self.app(scope, receive, send)
+        return Result(response['status'], _header_dict(response['headers']), b''.join(response['body']))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.app.pool.shutdown(wait=True)
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args): # 요청마다 찍는 로그는 측정을 방해한다.
+        pass
+
+
+class HTTPTransport(object):
+    def __init__(self, app, host='127.0.0.1', port=0):
+        self.server = make_server(host, port, app, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def send(self, method, path, body, headers):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60) # wsgiref는 HTTP/1.0이라 연결을 다시 쓰지 않는다.
+        try:
+            conn.request(method, path, body=body or None, headers=headers)
+            response = conn.getresponse()
+            content = response.read()
+            headers = {}
+            for name, value in response.getheaders():
+                headers.setdefault(name.lower(), []).append(value)
+            return Result(response.status, headers, content)
+        finally:
+            conn.close()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _header_dict(pairs):
+    headers = {}
+    for name, value in pairs:
+        headers.setdefault(name.lower(), []).append(value)
+    return headers
+
+
+def encode_multipart(fields, files=()):
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields:
+        lines.append('--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(
+            boundary, name, value).encode('utf-8'))
+    for name, filename, content_type, data in files:
+        lines.append('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\nContent-Type: {}\r\n\r\n'.format(
+            boundary, name, filename, content_type).encode('utf-8'))
+        lines.append(data + b'\r\n')
+    lines.append('--{}--\r\n'.format(boundary).encode('utf-8'))
+    return b''.join(lines), 'multipart/form-data; boundary={}'.format(boundary)
+
+
+class Session(object):
+    '''
+    쿠키(세션, CSRF)를 기억하는 클라이언트. 스레드마다 하나씩 쓴다.
+    '''
+    def __init__(self, transport):
+        self.transport = transport
+        self.cookies = SimpleCookie()
+
+    def request(self, method, path, data=None, files=()):
+        headers = {'Host': 'localhost'}
+        body = b''
+        if method == 'POST':
+            fields = list((data or {}).items())
+            if 'csrftoken' in self.cookies:
+                fields.append(('csrfmiddlewaretoken', self.cookies['csrftoken'].value))
+            if files:
+                body, headers['Content-Type'] = encode_multipart(fields, files)
+            else:
+                body = urlencode(fields).encode('utf-8')
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join('{}={}'.format(k, m.value) for k, m in self.cookies.items())
+
+        result = self.transport.send(method, path, body, headers)
+        for cookie in result.headers.get('set-cookie', []):
+            self.cookies.load(cookie)
+        return result
+
+    def login(self, username, password, login_url='/login/'):
+        self.request('GET', login_url) # csrftoken 쿠키를 받는다.
+        result = self.request('POST', login_url, {'username': username, 'password': password})
+        if result.status != 302:
+            raise RuntimeError('{} 로그인 실패 ({})'.format(username, result.status))
+
+    def location(self, result):
+        return urlsplit(result.headers['location'][0]).path
@@ -0,0 +1,57 @@
+import argparse
+import json
+import sys
+
+
+'''
+두 결과 파일(benchmarks.run)을 시나리오별로 나란히 보여준다.
+    python -m benchmarks.compare before.json after.json
+
+WSGI와 ASGI를 같은 워커 수로 비교할 때:
+    python -m benchmarks.run --mode wsgi --concurrency 32 --workers 8 -o wsgi.json
+    python -m benchmarks.run --mode asgi --concurrency 32 --workers 8 -o asgi.json
+    python -m benchmarks.compare wsgi.json asgi.json
+'''
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_mean', 'queries_max', 'peak_rss_kb')
+
+
+def change(before, after):
+    if before is None or after is None:
+        return ''
+    if before == 0:
+        return ''
+    return '{:+.1f}%'.format((after - before) * 100.0 / before)
+
+
+def compare(before, after, out=sys.stdout):
+    out.write('{} ({}) -> {} ({})\n'.format(
+        before['meta'].get('revision'), before['meta'].get('mode'),
+        after['meta'].get('revision'), after['meta'].get('mode'),
+    ))
+    for name in sorted(set(before['scenarios']) | set(after['scenarios'])):
+        a = before['scenarios'].get(name, {})
+        b = after['scenarios'].get(name, {})
+        out.write('\n[{}]\n'.format(name))
+        for metric in METRICS:
+            out.write('  {:<16}{:>12}{:>12}{:>10}\n'.format(
+                metric, '{}'.format(a.get(metric)), '{}'.format(b.get(metric)), change(a.get(metric), b.get(metric)),
+            ))
+        if a.get('errors') or b.get('errors'):
+            out.write('  {:<16}{:>12}{:>12}\n'.format('errors', '{}'.format(a.get('errors')), '{}'.format(b.get('errors'))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='두 측정 결과를 비교한다.')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    compare(before, after)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from . import env
+
+
+'''
+SQLite 설정별로 읽기와 댓글 쓰기를 동시에 돌려서 처리량과 지연 시간, 락 오류를 비교한다.
+    python -m benchmarks.dbconcurrency --readers 8 --writers 2 --seconds 10
+
+benchmarks.generate로 만든 DB를 설정마다 따로 복사해서 쓰므로 원본은 바뀌지 않는다.
+설정마다 별도 프로세스로 실행한다. (장고 설정과 연결은 프로세스 안에서 한 번만 정해진다)
+'''
+
+PROFILES = {
+    # 바꾸기 전: 장고 기본 (rollback journal)
+    'journal': {'journal_mode': 'delete', 'synchronous': 'full'},
+    # settings.SQLITE_PRAGMAS 기본값
+    'wal': None,
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def child(seconds, readers, writers, seed):
+    '''
+    --child 로 불렸을 때. 결과를 JSON 한 줄로 표준 출력에 쓴다.
+    '''
+    env.setup()
+    from django.db import connection, OperationalError
+    from blog.models import Post, Comment
+
+    dataset = env.load_dataset()
+    stop = time.time() + seconds
+    lock = threading.Lock()
+    stats = {'read': [], 'write': [], 'read_errors': 0, 'write_errors': 0}
+
+    def reader(n):
+        rng = random.Random('{}:r{}'.format(seed, n))
+        latencies, errors = [], 0
+        while time.time() < stop:
+            started = time.perf_counter()
+            try: # 글 목록 한 페이지와 글 하나의 댓글 목록
+                list(Post.objects.select_related('user', 'category')[:3])
+                list(Comment.objects.filter(post_id=rng.randint(1, dataset['posts'])).select_related('user'))
+                latencies.append(time.perf_counter() - started)
+            except OperationalError: # database is locked
+                errors += 1
+        connection.close()
+        with lock:
+            stats['read'].extend(latencies)
+            stats['read_errors'] += errors
+
+    def writer(n):
+        rng = random.Random('{}:w{}'.format(seed, n))
+        latencies, errors = [], 0
+        while time.time() < stop:
+            started = time.perf_counter()
+            try: # 댓글 저장 + touch_post_for_comment의 UPDATE
+                Comment.objects.create(
+                    post_id=rng.randint(1, dataset['posts']), user_id=rng.randint(1, dataset['users']),
+                    content='concurrency bench',
+                )
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                errors += 1
+        connection.close()
+        with lock:
+            stats['write'].extend(latencies)
+            stats['write_errors'] += errors
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+    result = {'journal_mode': journal_mode}
+    for kind in ('read', 'write'):
+        latencies = [t * 1000.0 for t in stats[kind]]
+        result[kind] = {
+            'ops_per_sec': round(len(latencies) / float(seconds), 1),
+            'p50_ms': latencies and round(percentile(latencies, 50), 3),
+            'p99_ms': latencies and round(percentile(latencies, 99), 3),
+            'errors': stats[kind + '_errors'],
+        }
+    sys.stdout.write(json.dumps(result) + '\n')
+
+
+def run_profile(name, pragmas, args):
+    from django.conf import settings
+    workdir = tempfile.mkdtemp()
+    try:
+        # 같은 데이터를 설정마다 새로 복사한다. journal_mode는 DB 파일에 기록되기 때문이다.
+        shutil.copy(settings.DATABASES['default']['NAME'], os.path.join(workdir, 'bench.sqlite3'))
+        shutil.copy(env.dataset_path(), os.path.join(workdir, 'dataset.json'))
+        child_env = dict(os.environ, BENCH_DIR=workdir)
+        if pragmas is not None:
+            child_env['BENCH_SQLITE_PRAGMAS'] = json.dumps(pragmas)
+        output = subprocess.check_output([
+            sys.executable, '-m', 'benchmarks.dbconcurrency', '--child',
+            '--seconds', str(args.seconds), '--readers', str(args.readers),
+            '--writers', str(args.writers), '--seed', str(args.seed),
+        ], cwd=env.BASE_DIR, env=child_env)
+        return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SQLite 설정별 동시 읽기/쓰기 비교')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--profiles', default=','.join(sorted(PROFILES)))
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return child(args.seconds, args.readers, args.writers, args.seed)
+
+    env.setup()
+    report = {
+        'meta': {'seconds': args.seconds, 'readers': args.readers, 'writers': args.writers, 'seed': args.seed},
+        'profiles': {},
+    }
+    for name in args.profiles.split(','):
+        sys.stderr.write('{} ...\n'.format(name))
+        report['profiles'][name] = run_profile(name, PROFILES[name], args)
+    sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
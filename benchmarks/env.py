@@ -0,0 +1,35 @@
+import json
+import os
+import sys
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(settings_module='benchmarks.settings'):
+    '''
+    측정용 설정으로 장고를 띄운다. 모델이나 myweb.wsgi를 import하기 전에 불러야 한다.
+    '''
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    os.environ['DJANGO_SETTINGS_MODULE'] = os.environ.get('BENCH_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def dataset_path():
+    from django.conf import settings
+    return os.path.join(settings.BENCH_DIR, 'dataset.json')
+
+
+def load_dataset():
+    path = dataset_path()
+    if not os.path.exists(path):
+        raise SystemExit('측정용 데이터가 없습니다. 먼저 python -m benchmarks.generate 를 실행하세요.')
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_dataset(info):
+    with open(dataset_path(), 'w') as f:
+        json.dump(info, f, indent=2, sort_keys=True)
@@ -0,0 +1,167 @@
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sys
+from io import BytesIO
+
+from . import env
+
+
+'''
+결정적인 측정용 데이터 만들기. 같은 인자와 --seed면 항상 같은 데이터가 나온다.
+빈 DB에 pk를 직접 정해서 bulk_create로 넣는다. (signal을 거치지 않으므로 검색 인덱스는 직접 채운다)
+'''
+
+BASE_TIME = datetime.datetime(2016, 1, 1)
+WORDS = (
+    '장고', '파이썬', '블로그', '사진', '여행', '커피', '서울', '부산', '개발', '캐시', '인덱스', '쿼리',
+    'django', 'python', 'photo', 'travel', 'coffee', 'cache', 'index', 'query', 'server', 'mobile',
+)
+PASSWORD = 'bench-password'
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_image(rng, width, height):
+    # 색 사각형 몇 개를 그린 JPEG. 글마다 내용이 달라 해시 저장소에서 파일이 겹치지 않는다.
+    from PIL import Image, ImageDraw
+    im = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(im)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.rectangle(
+            [x, y, x + rng.randrange(width // 2), y + rng.randrange(height // 2)],
+            fill=tuple(rng.randrange(256) for _ in range(3)),
+        )
+    out = BytesIO()
+    im.save(out, 'JPEG', quality=85)
+    return out.getvalue()
+
+
+def reset():
+    from django.conf import settings
+    from django.db import connection
+    connection.close()
+    if os.path.exists(settings.BENCH_DIR):
+        shutil.rmtree(settings.BENCH_DIR)
+
+
+def generate(posts, comments, long_thread, images, users, categories, tags, seed, batch_size, stdout=sys.stdout):
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.core.files.base import ContentFile
+    from django.core.management import call_command
+    from django.db import transaction
+
+    from blog import search
+    from blog.management.commands.import_posts import auto_now_add_disabled
+    from blog.models import Post, Comment, Category, Tag
+    import taskqueue
+
+    os.makedirs(settings.BENCH_DIR, exist_ok=True)
+    call_command('migrate', interactive=False, verbosity=0)
+    if Post.objects.exists():
+        raise SystemExit('측정용 DB가 비어 있지 않습니다. --reset으로 다시 만드세요.')
+
+    rng = random.Random(seed)
+    User = get_user_model()
+    password = make_password(PASSWORD) # 한 번만 해시한다.
+    User.objects.bulk_create([
+        User(pk=i, username='bench{}'.format(i), password=password) for i in range(1, users + 1)
+    ])
+    Category.objects.bulk_create([Category(pk=i, name='카테고리 {}'.format(i)) for i in range(1, categories + 1)])
+    Tag.objects.bulk_create([Tag(pk=i, name='tag{}'.format(i)) for i in range(1, tags + 1)])
+
+    # 가장 최근 글이 가장 많이 읽히므로 긴 댓글 스레드는 마지막 글에 단다.
+    long_thread_pk = posts if long_thread else None
+    comment_pk = 0
+    Through = Post.tag.through
+    for start in range(1, posts + 1, batch_size):
+        pks = range(start, min(start + batch_size, posts + 1))
+        batch = [
+            Post(
+                pk=pk,
+                user_id=rng.randint(1, users),
+                category_id=rng.randint(1, categories),
+                title=sentence(rng, rng.randint(3, 8)),
+                content='\n'.join(sentence(rng, rng.randint(10, 40)) for _ in range(rng.randint(2, 10))),
+                created_at=BASE_TIME + datetime.timedelta(minutes=pk),
+            )
+            for pk in pks
+        ]
+        post_comments = []
+        for post in batch:
+            post.render_content() # bulk_create는 save()를 거치지 않는다.
+            count = long_thread if post.pk == long_thread_pk else rng.randint(0, 2 * comments)
+            post.comment_count = count # bulk_create는 signal을 보내지 않으므로 댓글 수도 직접 넣는다.
+            for i in range(count):
+                comment_pk += 1
+                post_comments.append(Comment(
+                    pk=comment_pk, post_id=post.pk, user_id=rng.randint(1, users),
+                    content=sentence(rng, rng.randint(3, 20)),
+                ))
+        with transaction.atomic():
+            with auto_now_add_disabled(Post, 'created_at'):
+                Post.objects.bulk_create(batch)
+            Through.objects.bulk_create([
+                Through(post_id=post.pk, tag_id=tag_id)
+                for post in batch for tag_id in sorted(rng.sample(range(1, tags + 1), rng.randint(0, min(3, tags))))
+            ])
+            Comment.objects.bulk_create(post_comments)
+            search.index_posts(batch)
+        stdout.write('글 {} / {}\n'.format(pks[-1], posts))
+
+    # 사진은 최근 글부터 붙이고 축소본도 미리 만든다. (글 보기의 srcset)
+    for post in Post.objects.order_by('-pk')[:images]:
+        post.photo.save('bench.jpg', ContentFile(make_image(rng, 1600, 1200)), save=False)
+        post.set_photo_variants(taskqueue.render_thumbnails(post.photo.path))
+        Post.objects.filter(pk=post.pk).update(photo=post.photo.name, photo_variants=post.photo_variants)
+
+    info = {
+        'seed': seed,
+        'posts': posts,
+        'comments_per_post': comments,
+        'comments': comment_pk,
+        'long_thread': long_thread,
+        'long_thread_post': long_thread_pk,
+        'images': min(images, posts),
+        'users': users,
+        'categories': categories,
+        'tags': tags,
+        'password': PASSWORD,
+    }
+    env.save_dataset(info)
+    return info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='측정용 데이터를 만든다.')
+    parser.add_argument('--posts', type=int, default=10000, help='글 수 (예: 10000, 100000, 1000000)')
+    parser.add_argument('--comments', type=int, default=5, help='글당 평균 댓글 수')
+    parser.add_argument('--long-thread', type=int, default=2000, help='가장 최근 글에 달 댓글 수')
+    parser.add_argument('--images', type=int, default=50, help='사진을 붙일 최근 글 수')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--tags', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=2000, help='트랜잭션 하나에 넣을 글 수')
+    parser.add_argument('--reset', action='store_true', help='기존 측정용 DB와 업로드 폴더를 지우고 만든다.')
+    args = parser.parse_args(argv)
+
+    env.setup()
+    if args.reset:
+        reset()
+    info = generate(
+        args.posts, args.comments, args.long_thread, args.images, args.users,
+        args.categories, args.tags, args.seed, args.batch_size,
+    )
+    sys.stdout.write('글 {posts}개, 댓글 {comments}개를 만들었습니다.\n'.format(**info))
+
+
+if __name__ == '__main__':
+    main()
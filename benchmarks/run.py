@@ -0,0 +1,230 @@
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import env
+
+
+'''
+시나리오별로 요청을 --concurrency개의 스레드에서 보내고 지연 시간 분포, 처리량, 쿼리 수, 최대 RSS를 JSON으로 남긴다.
+결과 파일은 키를 정렬해 저장하므로 커밋끼리 diff나 benchmarks.compare로 비교할 수 있다.
+'''
+
+
+class Scenario(object):
+    '''
+    make_request(rng, ctx)는 (method, path, data, files)를 돌려준다.
+    login이 True면 스레드마다 다른 측정용 사용자로 로그인한 세션을 쓴다.
+    expect는 성공으로 칠 상태 코드들이다.
+    '''
+    def __init__(self, name, make_request, login=False, expect=(200,)):
+        self.name = name
+        self.make_request = make_request
+        self.login = login
+        self.expect = expect
+
+
+def _random_post(rng, ctx):
+    return rng.randint(1, ctx['dataset']['posts'])
+
+
+def _create_post(rng, ctx):
+    data = {
+        'title': 'bench post {}'.format(rng.randrange(10 ** 9)),
+        'content': 'bench content ' * rng.randint(5, 50),
+        'category': rng.randint(1, ctx['dataset']['categories']),
+    }
+    return 'POST', '/create_post/', data, ()
+
+
+def _create_post_photo(rng, ctx):
+    from .generate import make_image
+    method, path, data, _ = _create_post(rng, ctx)
+    return method, path, data, [('photo', 'bench.jpg', 'image/jpeg', make_image(rng, 1600, 1200))]
+
+
+SCENARIOS = [
+    Scenario('list_posts', lambda rng, ctx: ('GET', '/', None, ())),
+    Scenario('list_posts_deep', lambda rng, ctx: ('GET', '/?cursor=' + ctx['deep_cursor'], None, ())),
+    Scenario('view_post', lambda rng, ctx: ('GET', '/post/{}/'.format(_random_post(rng, ctx)), None, ())),
+    Scenario('view_post_long_thread', lambda rng, ctx: (
+        'GET', '/post/{}/'.format(ctx['dataset']['long_thread_post'] or ctx['dataset']['posts']), None, ())),
+    Scenario('create_post', _create_post, login=True, expect=(302,)),
+    Scenario('create_post_photo', _create_post_photo, login=True, expect=(302,)),
+    Scenario('create_comment', lambda rng, ctx: (
+        'POST', '/post/{}/'.format(_random_post(rng, ctx)),
+        {'content': 'bench comment {}'.format(rng.randrange(10 ** 9))}, ()), login=True, expect=(302,)),
+    # 스크립트로 다는 댓글: 새 댓글 한 줄과 댓글 수만 받는다. (redirect 후 글 보기를 다시 그리지 않는다)
+    Scenario('create_comment_ajax', lambda rng, ctx: (
+        'POST', '/post/{}/comments/new/?format=json'.format(_random_post(rng, ctx)),
+        {'content': 'bench comment {}'.format(rng.randrange(10 ** 9))}, ()), login=True, expect=(201,)),
+]
+
+
+def percentile(sorted_values, p):
+    # 최근접 순위 방식
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # 리눅스는 KB 단위
+
+
+def deep_cursor():
+    # 목록 한가운데 페이지의 커서. OFFSET 방식이면 여기서 느려진다.
+    from blog.models import Post
+    from blog.pagination import encode_cursor
+    count = Post.objects.count()
+    post = Post.objects.order_by('-created_at', '-pk')[count // 2]
+    return encode_cursor([post.created_at, post.pk], 'n')
+
+
+def run_scenario(scenario, transport, ctx, requests, concurrency, warmup, seed):
+    from .clients import Session
+
+    local = threading.local()
+    sessions = []
+    sessions_lock = threading.Lock()
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = Session(transport)
+            with sessions_lock:
+                sessions.append(local.session)
+                index = len(sessions)
+            if scenario.login:
+                user = 'bench{}'.format((index - 1) % ctx['dataset']['users'] + 1)
+                local.session.login(user, ctx['dataset']['password'])
+        return local.session
+
+    # 요청 순서는 seed로 정해 둔다. 스레드 수가 같으면 같은 요청들이 나간다.
+    rng = random.Random('{}:{}'.format(seed, scenario.name))
+    planned = [scenario.make_request(rng, ctx) for _ in range(warmup + requests)]
+
+    def send(req):
+        method, path, data, files = req
+        s = session()
+        start = time.perf_counter()
+        result = s.request(method, path, data, files)
+        return time.perf_counter() - start, result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, planned[:warmup])) # 로그인, 연결, 캐시 예열. 기록하지 않는다.
+        started = time.perf_counter()
+        results = list(pool.map(send, planned[warmup:]))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(t * 1000.0 for t, _ in results)
+    queries = [r.queries for _, r in results if r.queries is not None]
+    errors = {}
+    for _, r in results:
+        if r.status not in scenario.expect:
+            errors[str(r.status)] = errors.get(str(r.status), 0) + 1
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(latencies[-1], 3),
+        'throughput_rps': round(len(results) / elapsed, 2),
+        'queries_mean': round(sum(queries) / float(len(queries)), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+        'response_bytes_mean': int(sum(len(r.body) for _, r in results) / len(results)),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=env.BASE_DIR, stderr=subprocess.DEVNULL,
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='블로그 뷰의 지연 시간과 처리량을 잰다.')
+    parser.add_argument('--mode', choices=('wsgi', 'http', 'asgi'), default='wsgi',
+                        help='wsgi: 프로세스 안에서 앱을 직접 부른다 / http: 로컬 HTTP 서버로 보낸다 / asgi: myweb.asgi로 부른다')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='앱을 동시에 실행하는 스레드 수 (기본: concurrency). wsgi/asgi를 같은 수로 맞춰 비교한다.')
+    parser.add_argument('--requests', type=int, default=200, help='시나리오마다 기록할 요청 수')
+    parser.add_argument('--warmup', type=int, default=10, help='시나리오마다 기록하지 않고 먼저 보낼 요청 수')
+    parser.add_argument('--scenarios', default=','.join(s.name for s in SCENARIOS),
+                        help='쉼표로 구분한 시나리오 이름')
+    parser.add_argument('--no-queries', action='store_true',
+                        help='쿼리 수를 세지 않는다. (세는 비용도 지연 시간에 들어간다)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', default='-', help='결과 JSON 파일 (기본: 표준 출력)')
+    args = parser.parse_args(argv)
+
+    env.setup()
+    dataset = env.load_dataset()
+    from myweb.wsgi import application
+    from .clients import WSGITransport, HTTPTransport, ASGITransport, count_queries, limit_workers
+
+    app = application if args.no_queries else count_queries(application)
+    workers = max(1, args.workers or args.concurrency)
+    if args.mode == 'asgi':
+        transport = ASGITransport(app, workers)
+    else:
+        if workers < args.concurrency:
+            app = limit_workers(app, workers)
+        transport = WSGITransport(app) if args.mode == 'wsgi' else HTTPTransport(app)
+    ctx = {'dataset': dataset, 'deep_cursor': deep_cursor()}
+
+    names = [n.strip() for n in args.scenarios.split(',') if n.strip()]
+    by_name = dict((s.name, s) for s in SCENARIOS)
+    unknown = [n for n in names if n not in by_name]
+    if unknown:
+        parser.error('모르는 시나리오: {}'.format(', '.join(unknown)))
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'mode': args.mode,
+            'concurrency': args.concurrency,
+            'workers': workers,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'count_queries': not args.no_queries,
+            'dataset': dataset,
+        },
+        'scenarios': {},
+    }
+    try:
+        for name in names:
+            sys.stderr.write('{} ...\n'.format(name))
+            report['scenarios'][name] = run_scenario(
+                by_name[name], transport, ctx, args.requests, max(1, args.concurrency), args.warmup, args.seed,
+            )
+    finally:
+        transport.close()
+    report['peak_rss_kb'] = peak_rss_kb()
+
+    text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import os
+
+from myweb.settings import * # noqa
+
+
+# 측정용 설정. 개발 DB와 업로드 폴더를 건드리지 않는다.
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+BENCH_DIR = os.environ.get('BENCH_DIR', os.path.join(BASE_DIR, 'bench_data'))
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCH_DIR, 'bench.sqlite3'),
+    }
+}
+
+MEDIA_ROOT = os.path.join(BENCH_DIR, 'upload_files')
+BLOG_RESIZE_CACHE_DIR = os.path.join(BENCH_DIR, 'resize_cache')
+
+# 로그인을 여러 번 하므로 비밀번호 해시는 가벼운 것을 쓴다. (측정 대상이 아니다)
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# 축소본은 요청 밖에서 만든다. 브로커가 없어도 되도록 스레드 풀을 쓴다.
+TASKQUEUE_BACKEND = os.environ.get('BENCH_TASKQUEUE_BACKEND', 'thread')
+
+# benchmarks.dbconcurrency가 설정별로 PRAGMA를 바꿔 실행한다.
+if os.environ.get('BENCH_SQLITE_PRAGMAS'):
+    import json
+    SQLITE_PRAGMAS = json.loads(os.environ['BENCH_SQLITE_PRAGMAS'])
@@ -0,0 +1,198 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Max
+from django.http import Http404
+from django.views.decorators.http import condition
+from rest_framework import generics
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from . import caching
+from .conditional import make_etag
+from .models import Post, Comment, Category, Tag
+from .pagination import KeysetPaginator, InvalidCursor
+from .serializers import (
+    split_param, PostSerializer, CommentSerializer, CategorySerializer, TagSerializer,
+)
+
+
+'''
+읽기 전용 JSON API (/api/v1/...)
+    - 커서 페이지네이션: HTML 목록과 같은 KeysetPaginator를 쓴다. OFFSET이나 COUNT(*)가 없다.
+    - ?fields=id,title : 필요한 필드만 보낸다.
+    - ?embed=comments : 글 하나(/posts/<pk>/)에 최근 댓글 BLOG_API_EMBED_COMMENTS개를 넣는다.
+      글 목록에서는 받지 않는다. (긴 댓글 스레드 하나가 페이지 전체를 끝없이 키운다) 전체 댓글은 comments_url로 넘겨 본다.
+    - ETag: 바뀐 게 없으면 직렬화 없이 304
+    - 쿼리 수는 페이지 크기와 상관없이 정해져 있다. (글 목록: ETag 1 + 글 1 + 태그 1, 글 하나: [+ 댓글 1])
+'''
+
+
+class KeysetCursorPagination(BasePagination):
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            size = self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = getattr(view, 'keyset_ordering', None)
+        pagi = KeysetPaginator(queryset, self.get_page_size(request), ordering)
+        try:
+            self.page = pagi.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('잘못된 커서입니다.')
+        return list(self.page)
+
+    def _link(self, token):
+        if token is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self._link(self.page.next_token)),
+            ('previous', self._link(self.page.previous_token)),
+            ('results', data),
+        ]))
+
+
+class ReadOnlyAPIMixin(object):
+    # 공개 읽기 전용이라 인증이 필요 없다. 세션/유저 쿼리도 하지 않는다.
+    authentication_classes = ()
+    pagination_class = KeysetCursorPagination
+
+    def get_serializer_context(self):
+        context = super(ReadOnlyAPIMixin, self).get_serializer_context()
+        context['fields'] = split_param(self.request.query_params.get('fields'))
+        context['embed'] = split_param(self.request.query_params.get('embed'))
+        return context
+
+
+def post_queryset(request):
+    '''
+    PostSerializer가 쓰는 관계를 모두 미리 가져오는 queryset. 필요 없는 필드는 관계도 읽지 않는다.
+    긴 본문(content)도 보내지 않을 때는 읽지 않는다. excerpt와 content_html은 API가 쓰지 않는다.
+    '''
+    fields = split_param(request.GET.get('fields'))
+    wanted = lambda name: not fields or name in fields
+
+    qs = Post.objects.select_related(*[name for name in ('user', 'category') if wanted(name)])
+    qs = qs.defer(*['excerpt', 'content_html'] + ([] if wanted('content') else ['content']))
+    if wanted('tags'):
+        qs = qs.prefetch_related('tag')
+    return qs
+
+
+def wants_comments(request):
+    fields = split_param(request.GET.get('fields'))
+    return 'comments' in split_param(request.GET.get('embed')) and (not fields or 'comments' in fields)
+
+
+class PostList(ReadOnlyAPIMixin, generics.ListAPIView):
+    serializer_class = PostSerializer
+
+    def get_queryset(self):
+        if 'comments' in split_param(self.request.query_params.get('embed')):
+            raise ValidationError({'embed': ['글 목록에는 댓글을 넣지 않습니다. 글마다 comments_url을 쓰세요.']})
+        return post_queryset(self.request)
+
+
+class PostDetail(ReadOnlyAPIMixin, generics.RetrieveAPIView):
+    serializer_class = PostSerializer
+
+    def get_queryset(self):
+        return post_queryset(self.request)
+
+    def get_object(self):
+        post = super(PostDetail, self).get_object()
+        if wants_comments(self.request):
+            # 최근 댓글만 한 번에 가져와 오래된 순서로 넣는다. 댓글이 몇 개든 응답 크기가 정해져 있다.
+            limit = getattr(settings, 'BLOG_API_EMBED_COMMENTS', 20)
+            latest = Comment.objects.filter(post_id=post.pk).select_related('user').order_by('-created_at', '-pk')[:limit]
+            post.embedded_comments = list(reversed(latest))
+        return post
+
+
+class PostComments(ReadOnlyAPIMixin, generics.ListAPIView):
+    serializer_class = CommentSerializer
+    keyset_ordering = ('created_at', 'pk') # 글 보기 페이지처럼 오래된 댓글부터
+
+    def get_queryset(self):
+        if not Post.objects.filter(pk=self.kwargs['pk']).exists():
+            raise Http404('해당 글이 존재하지 않습니다.')
+        return Comment.objects.filter(post_id=self.kwargs['pk']).select_related('user')
+
+
+class CategoryList(ReadOnlyAPIMixin, generics.ListAPIView):
+    serializer_class = CategorySerializer
+    queryset = Category.objects.all()
+    keyset_ordering = ('pk',)
+
+
+class TagList(ReadOnlyAPIMixin, generics.ListAPIView):
+    serializer_class = TagSerializer
+    queryset = Tag.objects.all()
+    keyset_ordering = ('pk',)
+
+
+'''
+ETag. 응답 내용은 주소(버전, 쿼리 문자열)와 데이터 버전으로 정해진다. 로그인 여부와는 상관없다.
+데이터 버전은 HTML 페이지와 같은 것을 쓴다. (blog/conditional.py, blog/caching.py)
+'''
+
+
+def _query(request):
+    return request.GET.urlencode()
+
+
+def post_list_etag(request, version):
+    last_updated = Post.objects.aggregate(last=Max('updated_at'))['last']
+    return make_etag(
+        'api', version, 'posts', caching.get_versions(['list'])[0],
+        last_updated and last_updated.isoformat(), _query(request),
+    )
+
+
+def post_detail_etag(request, version, pk):
+    row = Post.objects.filter(pk=pk).values_list('updated_at', 'category_id').first()
+    if row is None:
+        return None
+    updated_at, category_id = row
+    # 태그나 카테고리 이름이 바뀌면 글의 updated_at은 그대로이고 조각 캐시 버전만 오른다.
+    namespaces = ['post:{}'.format(pk), 'category:{}'.format(category_id)]
+    return make_etag(
+        'api', version, 'post', pk, updated_at.isoformat(),
+        *(caching.get_versions(namespaces) + [_query(request)])
+    )
+
+
+def post_comments_etag(request, version, pk):
+    # 댓글이 바뀌면 touch_post_for_comment가 글의 updated_at을 올린다.
+    updated_at = Post.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return make_etag('api', version, 'comments', pk, updated_at.isoformat(), _query(request))
+
+
+def list_etag(name):
+    # 카테고리/태그는 바뀌면 'list' 버전이 오른다. (invalidate_category_cache, invalidate_tag_cache)
+    def etag(request, version):
+        return make_etag('api', version, name, caching.get_versions(['list'])[0], _query(request))
+    return etag
+
+
+post_list = condition(etag_func=post_list_etag)(PostList.as_view())
+post_detail = condition(etag_func=post_detail_etag)(PostDetail.as_view())
+post_comments = condition(etag_func=post_comments_etag)(PostComments.as_view())
+category_list = condition(etag_func=list_etag('categories'))(CategoryList.as_view())
+tag_list = condition(etag_func=list_etag('tags'))(TagList.as_view())
@@ -0,0 +1,15 @@
+from django.conf.urls import url
+
+from . import api
+
+
+app_name = 'api'
+
+# 주소의 버전은 rest_framework의 URLPathVersioning이 request.version으로 넘겨준다.
+urlpatterns = [
+    url(r'^posts/$', api.post_list, name='post_list'),
+    url(r'^posts/(?P<pk>[0-9]+)/$', api.post_detail, name='post_detail'),
+    url(r'^posts/(?P<pk>[0-9]+)/comments/$', api.post_comments, name='post_comments'),
+    url(r'^categories/$', api.category_list, name='category_list'),
+    url(r'^tags/$', api.tag_list, name='tag_list'),
+]
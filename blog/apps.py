@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class BlogConfig(AppConfig):
     name = 'blog'
+
+    def ready(self):
+        from . import dbtuning
+        connection_created.connect(dbtuning.configure_connection, dispatch_uid='blog.dbtuning.configure_connection')
+        request_started.connect(dbtuning.check_connections, dispatch_uid='blog.dbtuning.check_connections')
@@ -0,0 +1,95 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+'''
+렌더링한 템플릿 조각을 버전 키로 캐시한다.
+글/댓글/태그/카테고리가 바뀌면 signal이 해당 네임스페이스의 버전만 올리므로
+지울 키를 찾아다닐 필요가 없고, 예전 버전의 조각은 타임아웃으로 사라진다.
+'''
+
+LOCK_TIMEOUT = 10 # 렌더링 중인 프로세스가 죽어도 락이 영원히 남지 않도록
+LOCK_WAIT = 2.0 # 다른 프로세스가 첫 렌더링을 끝내길 기다리는 최대 시간
+LOCK_POLL = 0.05
+
+
+def get_cache():
+    return caches[getattr(settings, 'BLOG_CACHE_ALIAS', 'default')]
+
+
+def _version_key(namespace):
+    return 'blog:v:{}'.format(namespace)
+
+
+def _new_version():
+    # 버전 키가 밀려나 사라져도 예전 조각과 겹치지 않도록 시각 기반으로 시작한다.
+    return int(time.time() * 1000)
+
+
+def get_versions(namespaces):
+    cache = get_cache()
+    keys = [_version_key(ns) for ns in namespaces]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_version(), None)
+            found[key] = cache.get(key)
+        versions.append(found[key])
+    return versions
+
+
+def bump(*namespaces):
+    cache = get_cache()
+    for ns in namespaces:
+        key = _version_key(ns)
+        try:
+            cache.incr(key)
+        except ValueError: # 아직 버전이 없으면 새로 만든다.
+            cache.set(key, _new_version(), None)
+
+
+def fragment_key(name, namespaces, vary_on=()):
+    versions = get_versions(namespaces)
+    raw = ':'.join(
+        ['{}={}'.format(ns, v) for ns, v in zip(namespaces, versions)] +
+        ['{}'.format(v) for v in vary_on]
+    )
+    return 'blog:frag:{}:{}'.format(name, hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+
+def get_or_render(key, render, timeout=None):
+    '''
+    key의 값을 돌려주고, 없거나 만료됐으면 render()로 다시 만든다.
+    값에는 신선한 기한을 따로 적어두고 실제 캐시 수명은 조금 더 길게 잡는다.
+    기한이 지나면 락을 잡은 한 요청만 다시 렌더링하고 나머지는 이전 값을 쓴다.
+    '''
+    cache = get_cache()
+    if timeout is None:
+        timeout = getattr(settings, 'BLOG_CACHE_TIMEOUT', 300)
+    lock_key = key + ':lock'
+
+    cached = cache.get(key)
+    if cached is not None:
+        value, fresh_until = cached
+        if fresh_until > time.time() or not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            return value
+    elif not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        # 다른 요청이 렌더링 중이다. 잠깐 기다렸다가 그 결과를 쓴다.
+        deadline = time.time() + LOCK_WAIT
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached[0]
+        return render() # 너무 오래 걸리면 직접 렌더링만 하고 저장은 락 주인에게 맡긴다.
+
+    try:
+        value = render()
+        cache.set(key, (value, time.time() + timeout), timeout + LOCK_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return value
@@ -0,0 +1,64 @@
+import os
+import re
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections, transaction
+
+
+'''
+글이 지워진 뒤의 사진 파일 정리.
+post_delete signal은 지울 파일(원본과 축소본들)을 모아두기만 하고, 트랜잭션이 커밋되면
+모은 파일을 묶어서 태스크 큐(taskqueue.delete_photo_files)로 넘긴다.
+    - 요청 안에서 파일을 지우지 않는다.
+    - admin에서 글 여러 개를 한 번에 지워도 태스크는 묶음 단위로 나간다.
+    - 롤백되면 아무것도 지우지 않는다. (on_commit이 불리지 않는다)
+    - 다른 글이 같은 사진을 쓰는지는 실제로 지우는 시점에 다시 확인한다.
+      예약한 뒤에 같은 사진이 다시 올라왔으면 (HashedFileSystemStorage.mark_reused) 그 묶음은 지우지 않는다.
+'''
+
+LEGACY_THUMB_SUFFIX = '_thumb' # 예전 make_thumbnail이 만들던 'name_thumb.jpg'
+DERIVATIVE_SUFFIX_RE = re.compile(r'(_w\d+|_thumb)(?=\.[A-Za-z0-9]+$)')
+
+
+def derivative_names(name, renditions=None):
+    '''
+    원본 name에서 만들어진 파일 이름들. 기록된 축소본과 예전 방식의 _thumb 파일
+    '''
+    names = [v['name'] for v in (renditions or {}).get('variants', [])]
+    stem, ext = os.path.splitext(name)
+    names.append(stem + LEGACY_THUMB_SUFFIX + ext)
+    return names
+
+
+class _CleanupBatch(object):
+    def __init__(self):
+        self.groups = OrderedDict() # 원본 이름 -> 축소본 이름들
+
+    def add(self, name, derivatives):
+        self.groups.setdefault(name, set()).update(derivatives)
+
+    def flush(self):
+        import taskqueue # taskqueue는 장고 설정을 불러오므로 모델을 불러오는 중에는 import하지 않는다.
+        groups = [[name, sorted(derivatives)] for name, derivatives in self.groups.items()]
+        self.groups.clear()
+        size = getattr(settings, 'BLOG_CLEANUP_BATCH_SIZE', 100)
+        scheduled_at = time.time()
+        for i in range(0, len(groups), size):
+            taskqueue.delete_photo_files.delay(groups[i:i + size], scheduled_at)
+
+
+def schedule_photo_delete(name, renditions=None, using='default'):
+    '''
+    커밋되면 name과 그 축소본들을 지우도록 예약한다. 같은 트랜잭션의 예약은 한 묶음이 된다.
+    '''
+    conn = connections[using]
+    batch = getattr(conn, '_photo_cleanup_batch', None)
+    # 롤백되면 on_commit 목록에서 빠지므로 그 묶음은 버리고 새로 시작한다.
+    if batch is None or not any(func == batch.flush for sids, func in conn.run_on_commit):
+        batch = conn._photo_cleanup_batch = _CleanupBatch()
+        batch.add(name, derivative_names(name, renditions))
+        transaction.on_commit(batch.flush, using=using) # 트랜잭션 밖이면 바로 불린다.
+    else:
+        batch.add(name, derivative_names(name, renditions))
@@ -0,0 +1,59 @@
+import hashlib
+
+from django.db.models import Max
+
+from . import caching
+from .models import Post
+
+
+'''
+글 목록/글 보기의 ETag와 Last-Modified.
+views.py의 condition 데코레이터가 뷰를 실행하기 전에 부르므로 304면 템플릿도 댓글 쿼리도 없다.
+
+글 하나의 버전은 Post.updated_at과 그 글의 조각 캐시 버전('post:<pk>', 'category:<pk>')이다.
+댓글이 달리거나 지워지면 touch_post_for_comment signal이 글의 updated_at을 올리고,
+카테고리 이름이나 태그가 바뀌면 signal이 조각 캐시 버전을 올린다.
+'''
+
+
+def make_etag(*parts):
+    raw = ':'.join('{}'.format(p) for p in parts)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def _viewer(request):
+    # 로그인한 사용자 이름이 페이지에 들어가므로 사용자마다 다른 ETag가 되어야 한다.
+    # CSRF 토큰은 넣지 않는다. 쿠키 없는 클라이언트(CDN, 크롤러)는 요청마다 새 토큰을 받으므로 ETag가 다시 같아질 일이 없다.
+    return request.user.pk,
+
+
+def load_post(request, pk):
+    '''
+    글을 한 번만 읽어서 request에 보관한다. ETag 계산과 뷰가 같이 쓴다.
+    '''
+    if not hasattr(request, '_blog_post'):
+        # 글 보기는 미리 만든 content_html을 쓰므로 원문(content)은 읽지 않는다.
+        request._blog_post = Post.objects.select_related('user', 'category').defer('content').filter(pk=pk).first()
+    return request._blog_post
+
+
+def view_post_etag(request, pk):
+    post = load_post(request, pk)
+    if post is None:
+        return None
+    versions = caching.get_versions(post.cache_namespaces)
+    return make_etag('post', post.pk, post.updated_at.isoformat(), *(versions + list(_viewer(request))))
+
+
+def view_post_last_modified(request, pk):
+    post = load_post(request, pk)
+    return post.updated_at if post is not None else None
+
+
+def list_posts_etag(request):
+    # 글이 지워지면 MAX(updated_at)은 그대로이므로 조각 캐시의 'list' 버전도 같이 넣는다.
+    last_updated = Post.objects.aggregate(last=Max('updated_at'))['last']
+    return make_etag(
+        'list', caching.get_versions(['list'])[0], last_updated and last_updated.isoformat(),
+        request.GET.get('cursor', ''), *_viewer(request)
+    )
@@ -0,0 +1,68 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+'''
+DB 연결 설정. BlogConfig.ready()에서 signal에 연결한다.
+
+SQLite (settings.SQLITE_PRAGMAS)
+    연결이 만들어질 때마다 PRAGMA를 실행한다. 기본값은 WAL 모드라서 댓글을 쓰는 동안에도 읽기가 막히지 않는다.
+    값을 None으로 두면 그 PRAGMA는 건드리지 않는다.
+
+MySQL (DATABASES의 CONN_MAX_AGE, settings.DB_HEALTH_CHECK_INTERVAL)
+    CONN_MAX_AGE로 연결을 요청 사이에 다시 쓴다. 다시 쓰는 연결은 요청이 시작될 때
+    DB_HEALTH_CHECK_INTERVAL초에 한 번 ping으로 확인해서 끊겼으면 닫는다. (다음 쿼리가 새로 연결한다)
+'''
+
+logger = logging.getLogger('blog.dbtuning')
+
+DEFAULT_SQLITE_PRAGMAS = (
+    ('journal_mode', 'wal'), # 읽기와 쓰기가 서로 막지 않는다. DB 파일에 기록되어 계속 유지된다.
+    ('synchronous', 'normal'), # WAL에서는 normal이어도 DB가 깨지지 않는다. (전원이 나가면 마지막 커밋만 잃을 수 있다)
+    ('cache_size', -16000), # 음수는 KB 단위. 연결마다 16MB
+    ('mmap_size', 128 * 1024 * 1024),
+    ('busy_timeout', 5000), # 쓰기 락을 기다리는 시간(ms)
+    ('temp_store', 'memory'),
+)
+
+
+def sqlite_pragmas():
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+    if isinstance(pragmas, dict):
+        pragmas = sorted(pragmas.items()) # journal_mode를 먼저 바꿀 필요는 없다.
+    return [(name, value) for name, value in pragmas if value is not None]
+
+
+def configure_connection(sender, connection, **kwargs):
+    '''
+    connection_created signal. 새 연결마다 한 번 불린다.
+    '''
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for name, value in sqlite_pragmas():
+                cursor.execute('PRAGMA {} = {}'.format(name, value))
+    connection._health_checked_at = time.time()
+
+
+def check_connections(sender, **kwargs):
+    '''
+    request_started signal. 요청 사이에 남아 있던 연결이 아직 살아 있는지 확인한다.
+    장고 1.9는 오류가 났던 연결만 확인하므로, DB 서버가 연결을 끊은 경우(wait_timeout, 장애 조치)
+    첫 쿼리가 실패하는 것을 막는다.
+    '''
+    interval = getattr(settings, 'DB_HEALTH_CHECK_INTERVAL', 30)
+    if interval is None:
+        return
+    now = time.time()
+    for conn in connections.all():
+        if conn.connection is None or not conn.settings_dict.get('CONN_MAX_AGE'):
+            continue
+        if now - getattr(conn, '_health_checked_at', 0) < interval:
+            continue
+        conn._health_checked_at = now
+        if not conn.is_usable():
+            logger.warning('%s DB 연결이 끊겨 있어 닫습니다.', conn.alias)
+            conn.close()
@@ -1,7 +1,8 @@
 from django import forms
 from django.forms import ValidationError
 
-from .models import Post
+from .models import Post, Comment
+from taskqueue import check_image_budget, ImageTooLarge
 
 
 class PostEditForm(forms.ModelForm):
@@ -17,6 +18,17 @@ class PostEditForm(forms.ModelForm):
             raise ValidationError('바보스러운 기운이 난다.')
         return title.strip()
 
+    def clean_photo(self):
+        photo = self.cleaned_data.get('photo')
+        if photo and 'photo' in self.changed_data:
+            image = getattr(photo, 'image', None) # ImageField가 헤더를 읽어 둔 PIL 이미지
+            width, height = image.size if image is not None else (0, 0)
+            try:
+                check_image_budget(width, height, photo.size)
+            except ImageTooLarge as e:
+                raise ValidationError('사진이 너무 큽니다. ({})'.format(e))
+        return photo
+
     def clean(self):
         super(PostEditForm, self).clean()
         title = self.cleaned_data.get('title', '')
@@ -26,3 +38,16 @@ class PostEditForm(forms.ModelForm):
             self.add_error('title', '안녕은 이제 그만 안녕')
         if '안녕' in content:
             self.add_error('content', '안녕은 이제 그만 안녕')
+
+
+class CommentForm(forms.ModelForm):
+    class Meta:
+        model = Comment
+        fields = ('content',)
+        error_messages = {'content': {'required': '댓글 내용을 입력하세요.'}} # 스페이스만 있어도 지워져서 여기로 온다.
+
+    def clean_content(self):
+        content = self.cleaned_data.get('content', '')
+        if content == '' or content.isspace(): # 내용이 없거나 스페이스만 있는 댓글은 달리지 않는다.
+            raise ValidationError('댓글 내용을 입력하세요.')
+        return content
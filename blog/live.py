@@ -0,0 +1,290 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template.loader import render_to_string
+from django.utils.module_loading import import_string
+
+
+'''
+글 보기의 새 댓글을 Server-Sent Events로 밀어준다. (views.post_events)
+    - 새 댓글은 커밋된 뒤 hub.publish('post:<pk>', ...)로 나간다. (models.publish_comment)
+    - 백엔드(BLOG_LIVE_BACKEND)가 메시지를 모든 프로세스에 나르고, 프로세스마다 하나뿐인 Hub가
+      그 글을 보고 있는 스트림들의 큐에 나눠 넣는다. 스트림마다 백엔드에 구독하지 않는다.
+        'blog.live.MemoryBackend' : 이 프로세스 안에서만 (개발, 테스트, 워커 하나)
+        'blog.live.RedisBackend'  : Redis PUBLISH/SUBSCRIBE로 여러 프로세스/서버에
+    - 이벤트 id는 댓글 pk다. 다시 연결하면서 Last-Event-ID를 보내면 그 뒤 댓글을 DB에서 읽어 먼저 보낸다.
+    - BLOG_LIVE_HEARTBEAT초마다 주석 줄을 보내 프록시가 연결을 끊지 않게 하고, 끊긴 연결을 알아챈다.
+    - 프로세스마다 BLOG_LIVE_MAX_CONNECTIONS개까지만 열고 넘치면 503을 돌려준다.
+      (WSGI에서는 스트림 하나가 워커 스레드 하나를 붙잡는다. ASGI(myweb/asgi.py)에서는 AsyncEventStream이
+      이벤트 루프에서 기다리므로 스레드를 붙잡지 않는다) 그래서 글 보기는 BLOG_LIVE_ENABLED일 때만 스트림을 연다.
+'''
+
+logger = logging.getLogger('blog.live')
+
+RESUME_LIMIT = 100 # 다시 연결했을 때 DB에서 읽어 보내는 최대 댓글 수. 더 밀렸으면 새로고침하는 게 낫다.
+PING = b': ping\n\n'
+
+
+class MemoryBackend(object):
+    '''
+    이 프로세스 안에서 바로 Hub로 넘긴다.
+    '''
+    def __init__(self, dispatch):
+        self.dispatch = dispatch
+
+    def publish(self, channel, message):
+        self.dispatch(channel, message)
+
+
+class RedisBackend(object):
+    '''
+    BLOG_LIVE_REDIS_URL의 Redis로 발행하고, 프로세스마다 스레드 하나가 'blog:live:*'를 구독해 Hub로 넘긴다.
+    '''
+    PREFIX = 'blog:live:'
+
+    def __init__(self, dispatch):
+        import redis # Redis 백엔드를 쓸 때만 필요하다.
+        self.dispatch = dispatch
+        self.client = redis.StrictRedis.from_url(getattr(settings, 'BLOG_LIVE_REDIS_URL', 'redis://localhost:6379/1'))
+        self.thread = threading.Thread(target=self.listen, name='blog-live-redis', daemon=True)
+        self.thread.start()
+
+    def publish(self, channel, message):
+        self.client.publish(self.PREFIX + channel, message)
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.PREFIX + '*')
+                for item in pubsub.listen():
+                    channel = item['channel'].decode('utf-8')[len(self.PREFIX):]
+                    data = item['data']
+                    self.dispatch(channel, data.decode('utf-8') if isinstance(data, bytes) else data)
+            except Exception as e: # 연결이 끊기면 잠시 뒤 다시 구독한다. 그 사이 댓글은 Last-Event-ID로 따라잡는다.
+                logger.warning('Redis 구독이 끊겼습니다: %s', e)
+                time.sleep(1)
+
+
+class Subscription(object):
+    def __init__(self, hub, channel, size):
+        self.hub = hub
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=size)
+        self.overflowed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full: # 읽는 쪽이 너무 느리다. 끊고 다시 연결할 때 DB에서 따라잡게 한다.
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    '''
+    이벤트 루프에서 기다리는 구독. 백엔드 스레드는 call_soon_threadsafe로 루프에 넘기기만 한다.
+    '''
+    def __init__(self, hub, channel, size, loop):
+        super(AsyncSubscription, self).__init__(hub, channel, size)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=size, loop=loop)
+
+    def put(self, message):
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout, loop=self.loop)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Hub(object):
+    '''
+    채널(글)별 구독자 목록. 백엔드에서 온 메시지를 그 채널의 구독자 큐에 넣는다.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.open_streams = 0
+        self._backend = None
+
+    @property
+    def backend(self):
+        with self.lock:
+            if self._backend is None:
+                path = getattr(settings, 'BLOG_LIVE_BACKEND', 'blog.live.MemoryBackend')
+                self._backend = import_string(path)(self.dispatch)
+            return self._backend
+
+    def publish(self, channel, payload):
+        try:
+            self.backend.publish(channel, json.dumps(payload))
+        except Exception as e: # 실시간 알림이 실패해도 댓글 달기는 성공해야 한다.
+            logger.warning('%s 발행 실패: %s', channel, e)
+
+    def dispatch(self, channel, message):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for sub in subscribers:
+            try:
+                sub.put(message)
+            except RuntimeError: # 이벤트 루프가 이미 닫힌 구독
+                self.unsubscribe(sub)
+
+    def subscribe(self, channel, loop=None):
+        self.backend # 구독하기 전에 백엔드(Redis 구독 스레드)를 띄운다.
+        size = getattr(settings, 'BLOG_LIVE_QUEUE_SIZE', 100)
+        sub = AsyncSubscription(self, channel, size, loop) if loop else Subscription(self, channel, size)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            subs = self.channels.get(sub.channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self.channels[sub.channel]
+
+    def acquire_stream(self):
+        with self.lock:
+            if self.open_streams >= getattr(settings, 'BLOG_LIVE_MAX_CONNECTIONS', 100):
+                return False
+            self.open_streams += 1
+            return True
+
+    def release_stream(self):
+        with self.lock:
+            self.open_streams -= 1
+
+
+hub = Hub()
+
+
+def channel_for(post_pk):
+    return 'post:{}'.format(post_pk)
+
+
+def comment_event(comment):
+    '''
+    스트림으로 보낼 댓글. 구독자마다 그리지 않도록 발행할 때 한 번만 줄 HTML을 만든다.
+    '''
+    data = comment.as_dict()
+    data['html'] = render_to_string('comment_row.html', {'comment': comment})
+    return data
+
+
+def publish_comment(comment):
+    hub.publish(channel_for(comment.post_id), comment_event(comment))
+
+
+def format_event(data, event_id=None, event='comment'):
+    lines = []
+    if event_id is not None:
+        lines.append('id: {}'.format(event_id))
+    lines.append('event: {}'.format(event))
+    lines.extend('data: {}'.format(line) for line in data.splitlines() or [''])
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class EventStream(object):
+    '''
+    StreamingHttpResponse에 넘기는 본문. 연결이 끝나면 (WSGI 서버가 close()를 부른다) 구독과 연결 수를 돌려놓는다.
+    스트림을 연 뒤에 빠진 댓글을 읽으므로 그 사이에 달린 댓글은 두 번 올 수 있다. 이미 보낸 id로 걸러낸다.
+    (pk는 커밋 순서와 다를 수 있으므로 가장 큰 id보다 작다고 버리지 않는다)
+    '''
+    def __init__(self, post_pk, last_event_id, loop=None):
+        self.post_pk = post_pk
+        self.last_id = last_event_id or 0 # 놓친 댓글을 읽기 시작할 곳
+        self.sent = set()
+        self.subscription = hub.subscribe(channel_for(post_pk), loop)
+        self.closed = False
+        self.heartbeat = getattr(settings, 'BLOG_LIVE_HEARTBEAT', 15)
+        # 오래 열린 연결은 BLOG_LIVE_MAX_SECONDS마다 끊는다. 브라우저가 Last-Event-ID로 다시 연결한다.
+        self.deadline = time.time() + getattr(settings, 'BLOG_LIVE_MAX_SECONDS', 300)
+
+    def backlog(self):
+        from .models import Comment
+        if not self.last_id:
+            return []
+        comments = list(
+            Comment.objects.filter(post_id=self.post_pk, pk__gt=self.last_id)
+            .select_related('user').order_by('pk')[:RESUME_LIMIT]
+        )
+        return [comment_event(comment) for comment in comments]
+
+    def preamble(self):
+        '''
+        retry와 놓친 댓글들. DB를 읽는 건 여기까지다.
+        '''
+        chunks = ['retry: {}\n\n'.format(getattr(settings, 'BLOG_LIVE_RETRY_MS', 3000)).encode('utf-8')]
+        for data in self.backlog():
+            self.sent.add(data['id'])
+            chunks.append(format_event(json.dumps(data), data['id']))
+        # 이제부터는 DB를 쓰지 않으므로 스트림이 열려 있는 동안 DB 연결을 붙잡지 않는다.
+        for conn in connections.all():
+            if not conn.in_atomic_block:
+                conn.close()
+        return chunks
+
+    def is_open(self):
+        return not self.closed and time.time() < self.deadline and not self.subscription.overflowed
+
+    def accept(self, message):
+        if message is None:
+            return PING
+        data = json.loads(message)
+        if data['id'] in self.sent:
+            return None
+        self.sent.add(data['id'])
+        return format_event(message, data['id'])
+
+    def __iter__(self):
+        for chunk in self.preamble():
+            yield chunk
+        while self.is_open():
+            chunk = self.accept(self.subscription.get(timeout=self.heartbeat))
+            if chunk is not None:
+                yield chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.subscription.close()
+        hub.release_stream()
+
+
+class AsyncEventStream(EventStream):
+    '''
+    ASGI에서 쓰는 스트림. preamble()만 스레드 풀에서 부르고 새 댓글은 루프에서 기다린다.
+        async for chunk in stream.events(): ...
+    '''
+    async def events(self):
+        while self.is_open():
+            chunk = self.accept(await self.subscription.get(timeout=self.heartbeat))
+            if chunk is not None:
+                yield chunk
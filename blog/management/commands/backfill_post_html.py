@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog import caching
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = '글의 excerpt와 content_html을 content로 다시 만든다. 결과가 다른 글만 고친다. (0014 마이그레이션 뒤, 또는 만드는 규칙이 바뀌었을 때)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='한 번에 읽고 한 트랜잭션에서 고칠 글 수')
+        parser.add_argument('--start-after', type=int, default=0,
+                            help='이 pk 다음 글부터 시작한다.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.only('pk', 'content', 'excerpt', 'content_html').order_by('pk')
+        last_pk = options['start_after']
+        checked = updated = 0
+
+        while True:
+            # pk 기준으로 끊어 읽으므로 글이 많아도 메모리는 배치 크기만큼만 쓴다.
+            batch = list(posts.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            changed = []
+            with transaction.atomic():
+                for post in batch:
+                    excerpt, content_html = post.excerpt, post.content_html
+                    post.render_content()
+                    if (post.excerpt, post.content_html) != (excerpt, content_html): # 같으면 쓰지 않는다.
+                        # update()는 updated_at과 signal을 건드리지 않는다.
+                        Post.objects.filter(pk=post.pk).update(excerpt=post.excerpt, content_html=post.content_html)
+                        changed.append(post.pk)
+            if changed:
+                # 0014 뒤 빈 excerpt/content_html로 그려 둔 목록과 글 보기 조각(과 ETag)을 버린다.
+                caching.bump('list', *['post:{}'.format(pk) for pk in changed])
+            updated += len(changed)
+            checked += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write('{}개 확인 (마지막 pk {}) / {}개 고침'.format(checked, last_pk, updated))
@@ -0,0 +1,113 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from blog.models import Post
+import taskqueue
+
+
+class Command(BaseCommand):
+    help = '사진이 있는 글 중 축소본이 없거나 오래된 글의 축소본을 여러 프로세스로 만든다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='한 번에 DB에서 읽고 프로세스 풀에 넘길 글 수')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='축소본을 만들 프로세스 수 (기본: CPU 수)')
+        parser.add_argument('--start-after', type=int, default=None,
+                            help='이 pk 다음 글부터 시작한다.')
+        parser.add_argument('--state-file', default=None,
+                            help='배치가 끝날 때마다 마지막 pk를 기록하고, 다시 실행하면 거기서 이어간다.')
+        parser.add_argument('--force', action='store_true',
+                            help='최신 축소본이 있어도 다시 기록한다.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='만들어야 할 글만 보여주고 아무것도 쓰지 않는다.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        state_file = options['state_file']
+        last_pk = options['start_after']
+        if last_pk is None and state_file and os.path.exists(state_file):
+            with open(state_file) as f:
+                last_pk = int(f.read().strip() or 0)
+        last_pk = last_pk or 0
+
+        posts = Post.objects.exclude(photo='').exclude(photo__isnull=True).only('pk', 'photo', 'photo_variants')
+        total = posts.filter(pk__gt=last_pk).count()
+        done = rendered = skipped = failed = 0
+        decode_ms = peak_bytes = 0 # 워커 수/메모리를 정할 때 참고할 축소본 통계
+
+        # 포크된 워커가 부모의 DB 연결을 같이 쓰지 않도록 닫아둔다. 워커는 DB를 쓰지 않는다.
+        if not connection.in_atomic_block:
+            connection.close()
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            while True:
+                # pk 기준으로 끊어 읽으므로 전체 글 수와 상관없이 메모리는 배치 크기만큼만 쓴다.
+                batch = list(posts.filter(pk__gt=last_pk).order_by('pk')[:batch_size].iterator())
+                if not batch:
+                    break
+
+                todo = []
+                for post in batch:
+                    if not options['force'] and self.is_up_to_date(post):
+                        skipped += 1
+                    elif not os.path.exists(post.photo.path):
+                        self.stderr.write('#{} 원본 없음: {}'.format(post.pk, post.photo.name))
+                        failed += 1
+                    else:
+                        todo.append(post)
+
+                if dry_run:
+                    for post in todo:
+                        self.stdout.write('#{} {}'.format(post.pk, post.photo.name))
+                    rendered += len(todo)
+                else:
+                    futures = [(post, pool.submit(taskqueue.render_thumbnails, post.photo.path)) for post in todo]
+                    for post, future in futures:
+                        try:
+                            result = future.result()
+                        except Exception as e: # 깨진 이미지 하나 때문에 전체를 멈추지 않는다.
+                            self.stderr.write('#{} 실패: {}'.format(post.pk, e))
+                            failed += 1
+                            continue
+                        post.set_photo_variants(result)
+                        post.save(update_fields=['photo_variants', 'updated_at']) # 글 보기의 Last-Modified도 올린다.
+                        rendered += 1
+                        decode_ms += result['stats']['decode_ms']
+                        peak_bytes = max(peak_bytes, result['stats']['peak_bytes'])
+
+                done += len(batch)
+                last_pk = batch[-1].pk
+                if state_file and not dry_run:
+                    with open(state_file, 'w') as f:
+                        f.write(str(last_pk))
+                self.stdout.write('{}/{} (마지막 pk {}) 생성 {} / 최신 {} / 실패 {}'.format(
+                    done, total, last_pk, rendered, skipped, failed))
+
+        if rendered and not dry_run:
+            self.stdout.write('디코딩 평균 {:.1f}ms / 한 장의 최대 버퍼 {:.1f}MB (워커마다)'.format(
+                decode_ms / rendered, peak_bytes / 1024.0 / 1024))
+        if failed:
+            raise CommandError('{}개 글의 축소본을 만들지 못했습니다.'.format(failed))
+
+    def is_up_to_date(self, post):
+        '''
+        기록된 축소본이 지금 설정의 너비를 모두 갖고 있고 파일이 원본보다 새것이면 건너뛴다.
+        '''
+        renditions = post.photo_renditions()
+        if renditions is None:
+            return False
+        path = post.photo.path
+        try:
+            source_mtime = os.path.getmtime(path)
+            for variant_path in taskqueue.expected_variants(path, renditions['width']):
+                if os.path.getmtime(variant_path) < source_mtime:
+                    return False
+        except OSError: # 원본이나 축소본 파일이 없다.
+            return False
+        recorded = set(os.path.basename(v['name']) for v in renditions['variants'])
+        expected = set(os.path.basename(p) for p in taskqueue.expected_variants(path, renditions['width']))
+        return expected <= recorded
@@ -0,0 +1,65 @@
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+
+
+def post_to_dict(post, tags):
+    return {
+        'id': post.pk,
+        'title': post.title,
+        'content': post.content,
+        'user': post.user.username,
+        'category': post.category.name,
+        'tags': tags,
+        'photo': post.photo.name or None,
+        'created_at': post.created_at.isoformat(),
+        'updated_at': post.updated_at.isoformat(),
+    }
+
+
+class Command(BaseCommand):
+    help = '글을 한 줄에 하나씩 JSON Lines로 내보낸다. (import_posts로 다시 읽을 수 있다)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', default='-',
+                            help='내보낼 파일 (기본: 표준 출력)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='한 번에 DB에서 읽을 글 수')
+        parser.add_argument('--start-after', type=int, default=0,
+                            help='이 pk 다음 글부터 내보낸다.')
+
+    def handle(self, *args, **options):
+        if options['output'] == '-':
+            self.write_posts(self.stdout.write, options) # 줄바꿈은 OutputWrapper가 붙인다.
+        else:
+            with open(options['output'], 'w', encoding='utf-8') as out:
+                count = self.write_posts(lambda line: out.write(line + '\n'), options)
+            self.stderr.write('{}개 글을 {}에 내보냈습니다.'.format(count, options['output']))
+
+    def write_posts(self, write, options):
+        '''
+        pk 순서로 batch_size개씩 끊어 읽는다. (장고 1.9의 iterator()에는 chunk_size가 없다)
+        글 수와 상관없이 메모리에는 한 배치만 있고, 배치마다 쿼리는 글 1 + 태그 1번이다.
+        '''
+        posts = Post.objects.select_related('user', 'category').order_by('pk')
+        through = Post.tag.through.objects
+        last_pk = options['start_after']
+        count = 0
+        while True:
+            batch = list(posts.filter(pk__gt=last_pk)[:options['batch_size']].iterator())
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            tags = defaultdict(list)
+            rows = through.filter(post_id__in=[p.pk for p in batch]).order_by('pk').values_list('post_id', 'tag__name')
+            for post_id, name in rows.iterator():
+                tags[post_id].append(name)
+
+            for post in batch:
+                write(json.dumps(post_to_dict(post, tags[post.pk]), ensure_ascii=False))
+            count += len(batch)
+        return count
@@ -0,0 +1,164 @@
+import json
+import sys
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from blog import caching, search
+from blog.models import Post, Category, Tag
+
+
+@contextmanager
+def auto_now_add_disabled(model, name):
+    '''
+    bulk_create 동안 auto_now_add를 꺼서 가져온 created_at을 그대로 쓴다.
+    '''
+    field = model._meta.get_field(name)
+    saved, field.auto_now_add = field.auto_now_add, False
+    try:
+        yield
+    finally:
+        field.auto_now_add = saved
+
+
+class NameCache(object):
+    '''
+    이름 -> pk. 처음 보는 이름만 DB에 묻고, create가 True면 없는 이름은 만든다.
+    dry_run이면 만들지 않고 만들 이름을 would_create에 모은다. (pk는 None)
+    '''
+    def __init__(self, model, field, create=True, dry_run=False):
+        self.model = model
+        self.field = field
+        self.create = create
+        self.dry_run = dry_run
+        self.would_create = []
+        self.pks = {}
+
+    def get(self, name):
+        if name not in self.pks:
+            obj = self.model.objects.filter(**{self.field: name}).order_by('pk').first()
+            if obj is None:
+                if not self.create:
+                    raise ValueError('{} "{}"이(가) 없습니다.'.format(self.model.__name__, name))
+                if self.dry_run:
+                    self.would_create.append(name)
+                    self.pks[name] = None
+                    return None
+                obj = self.model.objects.create(**{self.field: name})
+            self.pks[name] = obj.pk
+        return self.pks[name]
+
+
+class Command(BaseCommand):
+    help = 'export_posts가 만든 JSON Lines 파일에서 글을 한꺼번에 가져온다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', nargs='?', default='-',
+                            help='가져올 파일 (기본: 표준 입력)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='bulk_create 한 번, 트랜잭션 하나에 넣을 글 수')
+        parser.add_argument('--user', default=None,
+                            help='글쓴이가 없거나 없는 사용자일 때 대신 쓸 사용자 이름')
+        parser.add_argument('--keep-dates', action='store_true',
+                            help='파일의 created_at을 그대로 쓴다. (기본은 가져온 시각)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='파일만 검사하고 아무것도 쓰지 않는다.')
+
+    def handle(self, *args, **options):
+        self.users = NameCache(get_user_model(), 'username', create=False)
+        # --dry-run이면 처음 보는 카테고리와 태그도 만들지 않는다.
+        self.categories = NameCache(Category, 'name', dry_run=options['dry_run'])
+        self.tags = NameCache(Tag, 'name', dry_run=options['dry_run'])
+        self.default_user = options['user']
+        self.keep_dates = options['keep_dates']
+        batch_size = max(1, options['batch_size'])
+
+        if options['input'] == '-':
+            self.import_lines(sys.stdin, batch_size, options['dry_run'])
+        else:
+            with open(options['input'], encoding='utf-8') as f:
+                self.import_lines(f, batch_size, options['dry_run'])
+
+    def import_lines(self, lines, batch_size, dry_run):
+        '''
+        파일을 한 줄씩 읽으므로 파일 크기와 상관없이 메모리에는 한 배치만 있다.
+        '''
+        batch = []
+        imported = failed = 0
+        for lineno, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                batch.append(self.build_post(json.loads(line)))
+            except (ValueError, KeyError, TypeError, ValidationError) as e: # 잘못된 줄 하나 때문에 전체를 멈추지 않는다.
+                self.stderr.write('{}번째 줄 실패: {}'.format(lineno, e))
+                failed += 1
+                continue
+            if len(batch) >= batch_size:
+                imported += self.flush(batch, dry_run)
+                batch = []
+                self.stdout.write('가져옴 {} / 실패 {}'.format(imported, failed))
+        if batch:
+            imported += self.flush(batch, dry_run)
+
+        if imported and not dry_run:
+            caching.bump('list') # bulk_create는 signal을 보내지 않는다.
+        self.stdout.write('가져옴 {} / 실패 {}'.format(imported, failed))
+        if dry_run:
+            self.stdout.write('새로 만들 카테고리 {} / 태그 {}'.format(
+                len(self.categories.would_create), len(self.tags.would_create)))
+        if failed:
+            raise CommandError('{}개 줄을 가져오지 못했습니다.'.format(failed))
+
+    def build_post(self, row):
+        username = row.get('user') or self.default_user
+        try:
+            user_id = self.users.get(username)
+        except ValueError:
+            if not self.default_user:
+                raise
+            user_id = self.users.get(self.default_user)
+
+        post = Post(
+            title=row['title'],
+            content=row['content'],
+            user_id=user_id,
+            category_id=self.categories.get(row['category']),
+            photo=row.get('photo') or None,
+        )
+        if self.keep_dates and row.get('created_at'):
+            post.created_at = Post._meta.get_field('created_at').to_python(row['created_at'])
+        post.full_clean(exclude=['user', 'category', 'photo', 'created_at', 'tag'])
+        post.render_content() # bulk_create는 save()를 거치지 않는다.
+        post._import_tags = [self.tags.get(name) for name in row.get('tags') or []]
+        return post
+
+    def flush(self, batch, dry_run):
+        if dry_run:
+            return len(batch)
+        with transaction.atomic():
+            # bulk_create는 (PostgreSQL이 아니면) pk를 돌려주지 않는다.
+            # 트랜잭션 안에서 넣기 전 최대 pk 다음의 새 행들을 넣은 순서대로 짝지어 pk를 되찾는다.
+            last_pk = Post.objects.aggregate(last=Max('pk'))['last'] or 0
+            if self.keep_dates:
+                with auto_now_add_disabled(Post, 'created_at'):
+                    Post.objects.bulk_create(batch)
+            else:
+                Post.objects.bulk_create(batch)
+            pks = list(Post.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True))
+            if len(pks) != len(batch):
+                raise CommandError('다른 곳에서 글이 동시에 추가되어 pk를 맞출 수 없습니다. 다시 실행해 주세요.')
+            for post, pk in zip(batch, pks):
+                post.pk = pk
+
+            Through = Post.tag.through
+            Through.objects.bulk_create([
+                Through(post_id=post.pk, tag_id=tag_id)
+                for post in batch for tag_id in sorted(set(post._import_tags))
+            ])
+            search.index_posts(batch) # post_save signal 대신 검색 인덱스를 같은 트랜잭션에서 채운다.
+        return len(batch)
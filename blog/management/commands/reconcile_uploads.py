@@ -0,0 +1,98 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.cleanup import DERIVATIVE_SUFFIX_RE
+from blog.models import Post
+from blog.storage import REUSED_DIR
+from taskqueue import SAVE_FORMATS
+
+
+class Command(BaseCommand):
+    help = '업로드 폴더에서 어느 글도 쓰지 않는 사진과 축소본을 찾는다. (--delete를 주면 지운다)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true',
+                            help='찾은 파일을 지운다. 없으면 목록만 보여준다.')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='한 번의 DB 조회로 확인할 파일 수')
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='이 시간(초)보다 최근에 바뀐 파일은 건드리지 않는다. (아직 저장 중인 글의 업로드, 다시 올라온 같은 사진)')
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('photo').storage
+        root = storage.location
+        self.delete = options['delete']
+        self.storage = storage
+        self.cutoff = time.time() - options['min_age']
+        self.checked = self.orphans = self.freed = 0
+
+        # 폴더를 걸으면서 batch_size개씩 DB에 물어본다. 파일 목록 전체를 메모리에 올리지 않는다.
+        batch = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            if dirpath == root and 'tmp' in dirnames:
+                dirnames.remove('tmp') # HashedFileSystemStorage가 저장 중인 임시 파일
+            dirnames.sort()
+            for filename in sorted(filenames):
+                name = os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, '/')
+                batch.append(name)
+                if len(batch) >= options['batch_size']:
+                    self.check(batch)
+                    batch = []
+        if batch:
+            self.check(batch)
+        if self.delete:
+            self.prune_reused_markers()
+
+        self.stdout.write('확인 {} / 고아 {} ({} 바이트{})'.format(
+            self.checked, self.orphans, self.freed, ' 삭제' if self.delete else ''))
+
+    def candidates(self, name):
+        '''
+        name을 원본으로 쓰는 글이 있을 수 있는 사진 이름들.
+        축소본(_w320, _thumb)은 원본 확장자를 모르므로 (WebP 축소본) 저장 가능한 확장자를 모두 본다.
+        '''
+        original = DERIVATIVE_SUFFIX_RE.sub('', name)
+        if original == name:
+            return [name]
+        stem = os.path.splitext(original)[0]
+        exts = set(SAVE_FORMATS) | set(ext.upper() for ext in SAVE_FORMATS)
+        return [stem + ext for ext in sorted(exts)]
+
+    def prune_reused_markers(self):
+        # --min-age보다 오래된 '다시 쓰임' 표시는 더 지켜줄 삭제 예약이 없다.
+        marker_dir = self.storage.path(REUSED_DIR)
+        if not os.path.isdir(marker_dir):
+            return
+        for filename in os.listdir(marker_dir):
+            path = os.path.join(marker_dir, filename)
+            try:
+                if os.path.getmtime(path) <= self.cutoff:
+                    os.remove(path)
+            except OSError: # 그 사이에 다시 표시되었거나 지워졌다.
+                continue
+
+    def check(self, names):
+        wanted = dict((name, self.candidates(name)) for name in names)
+        lookup = set(c for cands in wanted.values() for c in cands)
+        in_use = set(Post.objects.filter(photo__in=lookup).values_list('photo', flat=True))
+
+        for name in names:
+            self.checked += 1
+            if in_use.intersection(wanted[name]):
+                continue
+            path = self.storage.path(name)
+            try:
+                stat = os.stat(path)
+            except OSError: # 그 사이에 지워졌다.
+                continue
+            if stat.st_mtime > self.cutoff:
+                continue
+            if self.storage.reused_since(DERIVATIVE_SUFFIX_RE.sub('', name), self.cutoff): # 같은 사진이 최근에 다시 올라왔다.
+                continue
+            self.orphans += 1
+            self.freed += stat.st_size
+            self.stdout.write(name)
+            if self.delete:
+                self.storage.delete(name)
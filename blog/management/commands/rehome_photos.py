@@ -0,0 +1,60 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.storage import is_hashed_name
+
+
+class Command(BaseCommand):
+    help = '예전 방식(업로드한 이름 그대로)으로 저장된 글 사진을 내용 해시 경로로 옮기고 중복 파일을 합친다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='한 번에 DB에서 읽을 글 수')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='옮길 파일만 보여주고 아무것도 바꾸지 않는다.')
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('photo').storage
+        posts = Post.objects.exclude(photo='').exclude(photo__isnull=True).only('pk', 'photo', 'photo_variants')
+        last_pk = moved = missing = 0
+
+        while True:
+            batch = list(posts.filter(pk__gt=last_pk).order_by('pk')[:options['batch_size']].iterator())
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            for post in batch:
+                old_name = post.photo.name
+                if is_hashed_name(old_name):
+                    continue
+                old_path = storage.path(old_name)
+                if not os.path.exists(old_path):
+                    self.stderr.write('#{} 파일 없음: {}'.format(post.pk, old_name))
+                    missing += 1
+                    continue
+                if options['dry_run']:
+                    self.stdout.write('#{} {}'.format(post.pk, old_name))
+                    moved += 1
+                    continue
+
+                old_renditions = post.photo_renditions()
+                with open(old_path, 'rb') as f:
+                    new_name = storage.save(old_name, File(f)) # 해시를 계산하며 복사한다. 같은 내용이 있으면 복사하지 않는다.
+                post.photo.name = new_name
+                post.photo_variants = '' # 새 이름의 축소본은 backfill_thumbnails로 다시 만든다.
+                post.save(update_fields=['photo', 'photo_variants'])
+                moved += 1
+
+                # 예전 이름을 쓰는 글이 더 없으면 예전 파일과 축소본을 지운다.
+                if not Post.objects.filter(photo=old_name).exists():
+                    os.remove(old_path)
+                    for variant in (old_renditions or {}).get('variants', []):
+                        storage.delete(variant['name'])
+
+        self.stdout.write('옮김 {} / 파일 없음 {}'.format(moved, missing))
+        if moved and not options['dry_run']:
+            self.stdout.write('축소본은 manage.py backfill_thumbnails로 다시 만드세요.')
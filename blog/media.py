@@ -0,0 +1,168 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from . import resize
+from .storage import is_immutable_name, HASHED_NAME_RE
+
+
+'''
+업로드 파일을 내보내는 뷰. (django.views.static.serve 대신)
+    - Range / If-Range 로 일부만 받기 (동영상, 이어받기)
+    - 강한 ETag와 Last-Modified로 304 응답
+    - 해시 이름 파일은 내용이 바뀌지 않으므로 1년 동안 캐시
+    - 전체 파일은 FileResponse로 보내 WSGI 서버의 sendfile을 쓰게 한다.
+    - MEDIA_SENDFILE을 설정하면 파일 전송은 앞단 웹서버(nginx, apache)에 맡긴다.
+    - ?w=320&fmt=webp 가 붙으면 크기를 바꾼 사진을 내보낸다. (blog/resize.py)
+'''
+
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+STREAM_BLOCK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(name, stat):
+    match = HASHED_NAME_RE.match(name)
+    if match: # 해시 이름이면 이름이 곧 내용의 해시다.
+        return quote_etag(match.group(3))
+    return quote_etag('{:x}-{:x}'.format(int(stat.st_mtime), stat.st_size))
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None: # If-None-Match가 있으면 If-Modified-Since는 보지 않는다. (RFC 7232)
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag.strip('"') in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def parse_range(header, size):
+    '''
+    'bytes=0-99' 같은 단일 범위만 처리한다. 처리할 수 없는 형식이면 None (전체 전송),
+    파일 범위를 벗어나면 False (416)를 돌려준다.
+    '''
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '': # 'bytes=-500' 마지막 500바이트
+        length = int(end)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag # If-Range는 강한 비교만 한다.
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(last_modified) == date
+
+
+def _stream_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _sendfile_response(name, full_path):
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    response = HttpResponse()
+    if mode == 'x-accel-redirect': # nginx: internal location으로 보낸다.
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-uploads/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + name.lstrip('/')
+    else: # apache mod_xsendfile, lighttpd
+        response['X-Sendfile'] = full_path
+    del response['Content-Type'] # 앞단 서버가 파일에 맞게 정한다.
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path.lstrip('/'))
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404('파일이 없습니다.')
+    # 'x/../tmp/...' 같은 경로도 잡도록 정리된 경로로 검사하고, 아래에서도 이 이름을 쓴다.
+    path = os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, '/')
+    if path == 'tmp' or path.startswith('tmp/'): # 저장 중인 업로드 임시 파일 (HashedFileSystemStorage)
+        raise Http404('파일이 없습니다.')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('파일이 없습니다.')
+    if not os.path.isfile(full_path):
+        raise Http404('파일이 없습니다.')
+
+    if 'w' in request.GET or 'fmt' in request.GET:
+        return resize.serve_resized(request, path, full_path, stat)
+
+    etag = file_etag(path, stat)
+    last_modified = stat.st_mtime
+
+    if not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    elif getattr(settings, 'MEDIA_SENDFILE', None):
+        # 범위 요청과 전송은 앞단 서버가 처리한다. 캐시 헤더만 붙인다.
+        response = _sendfile_response(path, full_path)
+    else:
+        content_type, encoding = mimetypes.guess_type(full_path)
+        content_type = content_type or 'application/octet-stream'
+        size = stat.st_size
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and if_range_matches(request, etag, last_modified):
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+        elif byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            body = () if request.method == 'HEAD' else _stream_range(full_path, start, length)
+            response = StreamingHttpResponse(body, status=206, content_type=content_type)
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+            response['Content-Length'] = str(length)
+        else:
+            if request.method == 'HEAD':
+                response = HttpResponse(content_type=content_type)
+            else:
+                response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+            response['Content-Length'] = str(size)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if is_immutable_name(path):
+        response['Cache-Control'] = 'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+    else:
+        response['Cache-Control'] = 'public, max-age={}'.format(getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600))
+    return response
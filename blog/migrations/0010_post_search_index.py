@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from blog import search
+
+
+def create_search_index(apps, schema_editor):
+    search.create_index(schema_editor)
+    Post = apps.get_model('blog', 'Post')
+    search.index_posts(Post.objects.using(schema_editor.connection.alias).iterator(),
+                       using=schema_editor.connection.alias)
+
+
+def drop_search_index(apps, schema_editor):
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_post_created_at_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
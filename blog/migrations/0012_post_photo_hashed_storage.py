@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 18:40
+from __future__ import unicode_literals
+
+import blog.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_post_photo_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='photo',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=blog.storage.HashedFileSystemStorage(), upload_to=''),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 19:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_comments(apps, schema_editor):
+    # 글마다 따로 세지 않고 UPDATE 한 번으로 채운다.
+    qn = schema_editor.quote_name
+    schema_editor.execute(
+        'UPDATE {post} SET {count} = (SELECT COUNT(*) FROM {comment} WHERE {comment}.{post_id} = {post}.{id})'.format(
+            post=qn('blog_post'), comment=qn('blog_comment'), count=qn('comment_count'),
+            post_id=qn('post_id'), id=qn('id'),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_post_excerpt_content_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together=set([('post', 'created_at', 'id')]),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,36 @@
 
+import json
+import os
+
 from django.conf import settings
-from django.db import models
-from django.db.models.signals import post_delete
+from django.core.urlresolvers import reverse
+from django.db import models, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+from django.utils.html import linebreaks
+from django.utils.text import Truncator
+from django.db.models.signals import post_delete, post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
 
+from . import caching, cleanup, live, search
+from .storage import HashedFileSystemStorage
+
+
+EXCERPT_LENGTH = 500 # 글 목록에 보이는 앞부분 글자 수
+
 
 class Post(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL) # 유저만이 글을 쓸 수 있음
     title = models.CharField(max_length=200, db_index=True)
     content = models.TextField(blank=False) # 제한이 없는 아주 큰 문자열
-    photo = models.ImageField(blank=True, null=True)
+    photo = models.ImageField(blank=True, null=True, db_index=True, storage=HashedFileSystemStorage()) # 같은 사진은 한 파일로 저장된다.
+    photo_variants = models.TextField(blank=True, default='', editable=False) # make_thumbnail이 만든 축소본 목록 (JSON)
+    # content에서 미리 만들어 두는 값. 목록은 content 대신 excerpt만, 글 보기는 linebreaks 대신 content_html을 읽는다.
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, default='', editable=False)
+    content_html = models.TextField(blank=True, default='', editable=False) # 이스케이프하고 linebreaks를 거친 HTML
+    comment_count = models.PositiveIntegerField(default=0, editable=False) # 댓글을 저장/삭제할 때 F()로 고친다. bulk_create는 직접 맞춰야 한다.
     created_at = models.DateTimeField(auto_now_add=True) # 처음 데이터가 들어갈때 생성 일시가 자동으로 들어가도록
-    updated_at = models.DateTimeField(auto_now=True) # 저장 시점의 일시 정보를 입력
+    updated_at = models.DateTimeField(auto_now=True, db_index=True) # 저장 시점의 일시 정보를 입력. 글 목록 ETag가 MAX(updated_at)을 쓴다.
 
     tag = models.ManyToManyField('Tag', blank=True) # 'Tag' 모델 클래스의 이름을 문자열로 하는 이유는 장고가 나중에 처리하도록 하기 위해서. 문자열이 아닐 경우 Post 클래스보다 앞에 있어야 함.
     category = models.ForeignKey('Category', blank=False, null=False) # blank는 폼에서 사용하는 것 null은 db에서 사용하는 것
@@ -21,14 +40,110 @@ class Post(models.Model):
     def __str__(self):
         return '{} - {} : {}'.format(self.pk, self.title, self.content)
 
+    def render_content(self):
+        '''
+        content로 excerpt와 content_html을 채운다. 템플릿의 truncatechars:"500", linebreaks와 같은 결과
+        save()가 부르고, signal을 거치지 않는 bulk_create 전에는 직접 부른다.
+        '''
+        content = self.content or ''
+        self.excerpt = Truncator(content).chars(EXCERPT_LENGTH)
+        self.content_html = linebreaks(content, autoescape=True)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            if 'content' not in self.get_deferred_fields(): # content를 읽지 않은 글이면 바뀐 것도 없다.
+                self.render_content()
+        elif 'content' in update_fields:
+            self.render_content()
+            kwargs['update_fields'] = set(update_fields) | {'excerpt', 'content_html'}
+        super(Post, self).save(*args, **kwargs)
+
+    @property
+    def cache_namespaces(self): # 이 글을 그린 조각 캐시를 무효화하는 네임스페이스들
+        return ['post:{}'.format(self.pk), 'category:{}'.format(self.category_id)]
+
+    @property
+    def comments_cache_namespace(self):
+        return 'comments:{}'.format(self.pk)
+
+    def set_photo_variants(self, result):
+        '''
+        make_thumbnail 결과의 파일 경로를 storage 이름으로 바꿔 기록한다.
+        '''
+        dirname = os.path.dirname(self.photo.name)
+        variants = []
+        for v in result['variants']:
+            v = dict(v)
+            v['name'] = os.path.join(dirname, os.path.basename(v.pop('path')))
+            variants.append(v)
+        self.photo_variants = json.dumps({
+            'width': result['width'],
+            'height': result['height'],
+            'variants': variants,
+        })
+
+    def photo_renditions(self):
+        if not self.photo or not self.photo_variants:
+            return None
+        return json.loads(self.photo_variants)
+
+    def _photo_srcset(self, webp):
+        renditions = self.photo_renditions()
+        if renditions is None:
+            return ''
+        storage = self.photo.storage
+        candidates = [
+            '{} {}w'.format(storage.url(v['name']), v['width'])
+            for v in sorted(renditions['variants'], key=lambda v: v['width'])
+            if (v['type'] == 'image/webp') == webp
+        ]
+        if not candidates:
+            return ''
+        if not webp: # 가장 큰 후보는 원본
+            candidates.append('{} {}w'.format(self.photo.url, renditions['width']))
+        return ', '.join(candidates)
+
+    @property
+    def photo_srcset(self):
+        return self._photo_srcset(webp=False)
+
+    @property
+    def photo_webp_srcset(self):
+        return self._photo_srcset(webp=True)
+
     class Meta: # 디폴트 정렬 기준 설정 - 가장 최근글 우선
         ordering = ('-created_at', '-pk')
+        index_together = (('created_at', 'id'),) # 커서 페이지네이션이 정렬 순서 그대로 인덱스 범위 스캔을 하도록
 
 
 @receiver(post_delete, sender=Post)
 def delete_attached_immage(sender, **kwargs):
     instance = kwargs.pop('instance')
-    instance.photo.delete(save=False) # 이 명령이 사진 파일까지 지우게 된다. save가 True이면 삭제한 글이 자꾸 부활할 것이다.
+    if not instance.photo:
+        return
+    # 파일은 커밋된 뒤 태스크 큐에서 축소본과 함께 지운다. 같은 사진을 쓰는 다른 글이 있는지도 그때 확인한다.
+    cleanup.schedule_photo_delete(instance.photo.name, instance.photo_renditions(), using=kwargs['using'])
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, **kwargs): # 글이 저장될 때마다 검색 인덱스도 같은 트랜잭션에서 고친다.
+    update_fields = kwargs['update_fields']
+    if update_fields is not None and not {'title', 'content'} & set(update_fields):
+        return # 축소본 기록(photo_variants) 같은 저장은 검색할 내용이 그대로다. 지연된 필드를 읽지도 않는다.
+    search.index_posts([kwargs['instance']], using=kwargs['using'])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, **kwargs):
+    search.unindex_post(kwargs['instance'].pk, using=kwargs['using'])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_cache(sender, **kwargs): # 글이 바뀌면 글 목록과 그 글의 조각 캐시 버전을 올린다.
+    instance = kwargs['instance']
+    caching.bump('list', 'post:{}'.format(instance.pk))
 
 
 class Comment(models.Model):
@@ -41,6 +156,18 @@ class Comment(models.Model):
     def __str__(self):
         return '({}) - {}.{} : {}'.format(self.pk, self.post.pk, self.post.title, self.content)
 
+    def as_dict(self): # 댓글 JSON 응답과 실시간 스트림(blog/live.py)이 같은 모양을 쓴다.
+        return {
+            'id': self.pk,
+            'user': str(self.user),
+            'content': self.content,
+            'created_at': self.created_at.isoformat(),
+            'delete_url': reverse('delete_comment', kwargs={'pk': self.pk}),
+        }
+
+    class Meta:
+        index_together = (('post', 'created_at', 'id'),) # 글의 댓글을 (created_at, id) 순서로 이어서 읽는다.
+
 
 class Tag(models.Model):
      name = models.CharField(max_length=40)
@@ -54,3 +181,60 @@ class Category(models.Model):
 
     def __str__(self):
         return '({}) {}'.format(self.pk, self.name)
+
+
+@receiver(m2m_changed, sender=Post.tag.through)
+def invalidate_post_tags_cache(sender, **kwargs):
+    action = kwargs['action']
+    if action not in ('post_add', 'post_remove', 'pre_clear'): # clear는 지우기 전에 봐야 어떤 글인지 알 수 있다.
+        return
+    instance = kwargs['instance']
+    if kwargs['reverse']: # tag.post_set 쪽에서 바꾼 경우 pk_set은 글의 pk들이다.
+        post_pks = kwargs['pk_set'] or Post.tag.through.objects.filter(
+            tag_id=instance.pk).values_list('post_id', flat=True)
+    else:
+        post_pks = [instance.pk]
+    caching.bump('list', *['post:{}'.format(pk) for pk in post_pks])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_post_for_comment(sender, **kwargs):
+    # 댓글이 바뀌면 글 페이지도 바뀐 것이므로 글의 updated_at을 올린다. (글 보기 ETag/Last-Modified)
+    # update()는 signal을 보내지 않으므로 글 조각 캐시나 검색 인덱스는 건드리지 않는다.
+    # 댓글 수도 같은 UPDATE에서 DB가 더하고 빼므로 동시에 달린 댓글도 빠지지 않는다.
+    changes = {'updated_at': timezone.now()}
+    if kwargs['signal'] is post_delete:
+        changes['comment_count'] = Case(When(comment_count__gt=0, then=F('comment_count') - 1), default=0)
+    elif kwargs['created']:
+        changes['comment_count'] = F('comment_count') + 1
+    Post.objects.filter(pk=kwargs['instance'].post_id).update(**changes)
+
+
+@receiver(post_save, sender=Comment)
+def publish_new_comment(sender, **kwargs): # 새 댓글은 커밋된 뒤 그 글을 보고 있는 스트림으로 보낸다. 롤백되면 보내지 않는다.
+    if kwargs['created']:
+        instance = kwargs['instance']
+        transaction.on_commit(lambda: live.publish_comment(instance), using=kwargs['using'])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_cache(sender, **kwargs): # 댓글은 해당 글의 댓글 목록 조각만 무효화한다.
+    instance = kwargs['instance']
+    caching.bump(Post(pk=instance.post_id).comments_cache_namespace)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag) # 삭제 후에는 중간 테이블이 이미 비어 있다.
+def invalidate_tag_cache(sender, **kwargs):
+    instance = kwargs['instance']
+    post_pks = Post.tag.through.objects.filter(tag_id=instance.pk).values_list('post_id', flat=True)
+    caching.bump('list', 'tags', *['post:{}'.format(pk) for pk in post_pks]) # 'tags'는 admin 필터 선택지
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, **kwargs): # 카테고리 이름은 목록과 글 보기에 모두 나온다.
+    instance = kwargs['instance']
+    caching.bump('list', 'categories', 'category:{}'.format(instance.pk))
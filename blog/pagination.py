@@ -0,0 +1,168 @@
+import base64
+import json
+import math
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# DB 정수 컬럼이 담을 수 있는 범위. 이를 넘는 값은 DB 드라이버에서 OverflowError가 난다.
+INTEGER_MIN, INTEGER_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def check_range(value):
+    if isinstance(value, bool):
+        return
+    if isinstance(value, int) and not INTEGER_MIN <= value <= INTEGER_MAX:
+        raise ValueError(value)
+    if isinstance(value, float) and not math.isfinite(value): # json은 Infinity, NaN도 읽는다.
+        raise ValueError(value)
+
+
+def encode_cursor(values, direction):
+    '''
+    정렬 키 값들과 방향('n' 다음 / 'p' 이전)을 불투명한 토큰으로 만든다.
+    datetime은 마이크로초까지 보존하기 위해 isoformat을 그대로 쓴다.
+    '''
+    payload = [direction] + [
+        v.isoformat() if hasattr(v, 'isoformat') else v for v in values
+    ]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor(token)
+    if not isinstance(payload, list) or len(payload) != size + 1 or payload[0] not in ('n', 'p'):
+        raise InvalidCursor(token)
+    return payload[0], payload[1:]
+
+
+class KeysetPage(object):
+    '''
+    Paginator의 Page처럼 템플릿에서 순회할 수 있는 페이지.
+    object_list는 처음 접근할 때 쿼리한다. (캐시된 조각을 쓰면 쿼리 자체가 없다)
+    '''
+    def __init__(self, paginator, direction, values):
+        self.paginator = paginator
+        self.direction = direction
+        self.values = values
+        self._object_list = None
+        self._has_more = False
+
+    def _fetch(self):
+        if self._object_list is not None:
+            return
+        p = self.paginator
+        backwards = self.direction == 'p'
+        rows = p.fetch_rows(self.values, backwards, p.per_page + 1) # 다음 페이지가 있는지 보려고 한개 더 가져온다.
+        self._has_more = len(rows) > p.per_page
+        rows = rows[:p.per_page]
+        if backwards:
+            rows.reverse()
+        self._object_list = rows
+
+    @property
+    def object_list(self):
+        self._fetch()
+        return self._object_list
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+    __nonzero__ = __bool__
+
+    def has_next(self):
+        self._fetch()
+        if self.direction == 'p':
+            return self.values is not None # 이전 페이지로 왔으면 출발한 페이지가 다음 페이지다.
+        return self._has_more
+
+    def has_previous(self):
+        self._fetch()
+        if self.direction == 'p':
+            return self._has_more
+        return self.values is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_token(self):
+        if not self.has_next() or not self.object_list:
+            return None
+        return encode_cursor(self.paginator.key_of(self.object_list[-1]), 'n')
+
+    @property
+    def previous_token(self):
+        if not self.has_previous() or not self.object_list:
+            return None
+        return encode_cursor(self.paginator.key_of(self.object_list[0]), 'p')
+
+
+class KeysetPaginator(object):
+    '''
+    OFFSET과 COUNT(*) 없이 정렬 키 (예: created_at, pk) 기준으로 잘라내는 페이지네이터.
+    어느 페이지든 인덱스 범위 스캔 한 번으로 끝난다.
+    '''
+    def __init__(self, queryset, per_page, ordering=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering or queryset.model._meta.ordering)
+        self.fields = [o.lstrip('-') for o in self.ordering]
+        self.reversed_ordering = tuple(
+            o[1:] if o.startswith('-') else '-' + o for o in self.ordering
+        )
+
+    def key_of(self, obj):
+        return [getattr(obj, 'pk' if f == 'pk' else f) for f in self.fields]
+
+    def seek_filter(self, values, backwards=False):
+        '''
+        (a, b) 튜플 비교를 a < x OR (a = x AND b < y) 형태로 펼친다.
+        '''
+        q = None
+        for i, order in enumerate(self.ordering):
+            descending = order.startswith('-') != backwards
+            lookup = '{}__{}'.format(self.fields[i], 'lt' if descending else 'gt')
+            cond = Q(**{lookup: values[i]})
+            for j in range(i):
+                cond &= Q(**{self.fields[j]: values[j]})
+            q = cond if q is None else q | cond
+        return q
+
+    def fetch_rows(self, values, backwards, limit):
+        qs = self.queryset
+        if values is not None:
+            qs = qs.filter(self.seek_filter(values, backwards))
+        ordering = self.reversed_ordering if backwards else self.ordering
+        return list(qs.order_by(*ordering)[:limit])
+
+    def page(self, token=None):
+        if not token:
+            return KeysetPage(self, 'n', None)
+        direction, values = decode_cursor(token, len(self.fields))
+        opts = self.queryset.model._meta
+        try: # 조작된 토큰이 쿼리까지 가지 않도록 여기서 값을 검증한다.
+            values = [
+                (opts.pk if f == 'pk' else opts.get_field(f)).to_python(v)
+                for f, v in zip(self.fields, values)
+            ]
+            for v in values:
+                check_range(v)
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor(token)
+        return KeysetPage(self, direction, values)
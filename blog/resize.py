@@ -0,0 +1,234 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, quote_etag
+from PIL import Image
+
+import taskqueue
+
+from .storage import is_immutable_name
+
+
+'''
+/uploads/<path>?w=320&fmt=webp 로 원하는 너비/포맷의 사진을 그때그때 만들어 내보낸다. (serve_media가 부른다)
+    - 너비와 포맷은 허용 목록(BLOG_RESIZE_WIDTHS, BLOG_RESIZE_FORMATS)에 있는 것만 받는다.
+    - 만든 파일은 BLOG_RESIZE_CACHE_DIR에 원본 경로/크기/수정시각을 넣은 키로 저장한다.
+      원본이 바뀌면 키가 바뀌므로 옛 파일은 쓰이지 않다가 밀려난다.
+    - 임시 파일에 다 쓴 다음 rename하므로 반쯤 쓴 파일을 내보내지 않는다.
+    - 같은 키를 동시에 요청하면 한 요청만 만들고 나머지는 기다렸다가 그 파일을 쓴다. (프로세스 안에서)
+    - 캐시가 BLOG_RESIZE_CACHE_MAX_BYTES를 넘으면 가장 오래 안 쓴 파일부터 지운다. (mtime 기준 LRU)
+'''
+
+logger = logging.getLogger('blog.resize')
+
+FORMAT_EXTENSIONS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+}
+TOUCH_INTERVAL = 60 # 캐시 적중 때 mtime을 갱신하는 최소 간격(초). 적중마다 디스크에 쓰지 않는다.
+EVICT_TO = 0.9 # 넘치면 최대 크기의 이 비율까지 줄인다.
+
+_locks = {}
+_locks_guard = threading.Lock()
+_cache_size = None # 이 프로세스가 어림하는 캐시 크기. 처음 쓸 때 한 번 센다.
+_cache_size_lock = threading.Lock()
+
+
+class ResizeError(ValueError):
+    pass
+
+
+def allowed_widths():
+    return getattr(settings, 'BLOG_RESIZE_WIDTHS', (160, 320, 640, 1024, 1600))
+
+
+def allowed_formats():
+    formats = getattr(settings, 'BLOG_RESIZE_FORMATS', ('jpeg', 'png', 'webp'))
+    Image.init() # WebP는 Pillow가 libwebp와 함께 빌드됐을 때만 된다.
+    return [fmt for fmt in formats if fmt in FORMAT_EXTENSIONS and FORMAT_EXTENSIONS[fmt][0] in Image.SAVE]
+
+
+def cache_dir():
+    return getattr(settings, 'BLOG_RESIZE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'resize_cache'))
+
+
+def parse_params(params, path):
+    '''
+    ?w=&fmt= 를 검사한다. fmt가 없거나 이 서버가 만들 수 없는 포맷이면 원본 포맷을 쓴다.
+    '''
+    try:
+        width = int(params.get('w', ''))
+    except ValueError:
+        raise ResizeError('w는 숫자여야 합니다.')
+    if width not in allowed_widths():
+        raise ResizeError('허용된 너비가 아닙니다: {}'.format(', '.join(str(w) for w in allowed_widths())))
+
+    source_format = taskqueue.SAVE_FORMATS.get(os.path.splitext(path)[1].lower())
+    if source_format is None:
+        raise ResizeError('사진 파일이 아닙니다.')
+    fmt = params.get('fmt', '').lower()
+    if fmt and fmt not in FORMAT_EXTENSIONS:
+        raise ResizeError('허용된 포맷이 아닙니다: {}'.format(', '.join(sorted(FORMAT_EXTENSIONS))))
+    if fmt not in allowed_formats():
+        fmt = source_format.lower() if source_format.lower() in allowed_formats() else 'jpeg'
+    return width, fmt
+
+
+def cache_key(path, stat, width, fmt):
+    raw = '{}|{}|{}|{}|{}'.format(path, stat.st_size, int(stat.st_mtime), width, fmt)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def cache_path(key, fmt):
+    return os.path.join(cache_dir(), key[:2], key + FORMAT_EXTENSIONS[fmt][1])
+
+
+@contextmanager
+def _key_lock(key):
+    '''
+    같은 키를 만드는 요청을 하나로 모은다. 아무도 안 쓰는 잠금은 지워서 dict가 커지지 않게 한다.
+    '''
+    with _locks_guard:
+        entry = _locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _locks[key]
+
+
+def render(full_path, output_path, width, fmt):
+    '''
+    원본을 width 너비로 줄여서 output_path에 원자적으로 쓴다. 원본보다 크게 늘리지는 않는다.
+    '''
+    pil_format = FORMAT_EXTENSIONS[fmt][0]
+    with taskqueue.open_upright(full_path, [width]) as (im, source_width, source_height, stats):
+        if width < source_width:
+            height = max(1, int(round(source_height * width / float(source_width))))
+            im = im.resize((width, height), Image.ANTIALIAS)
+        if pil_format == 'JPEG' and im.mode != 'RGB':
+            im = im.convert('RGB')
+
+        directory = os.path.dirname(output_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                im.save(f, pil_format, quality=getattr(settings, 'BLOG_THUMBNAIL_QUALITY', 85))
+            os.replace(tmp_path, output_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return os.path.getsize(output_path)
+
+
+def _scan():
+    '''
+    캐시 폴더의 (mtime, 크기, 경로) 목록. 쓰는 중인 임시 파일은 빼고 센다.
+    '''
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(cache_dir()):
+        for filename in filenames:
+            if filename.endswith('.tmp'):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except OSError: # 다른 프로세스가 방금 지웠다.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _account(nbytes):
+    '''
+    새로 쓴 크기를 더하고, 최대 크기를 넘으면 오래 안 쓴 파일부터 EVICT_TO까지 지운다.
+    여러 프로세스가 캐시를 나눠 쓰므로 지울 때는 폴더를 다시 세서 맞춘다.
+    '''
+    global _cache_size
+    max_bytes = getattr(settings, 'BLOG_RESIZE_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+    with _cache_size_lock:
+        if _cache_size is None:
+            _cache_size = sum(size for mtime, size, path in _scan())
+        else:
+            _cache_size += nbytes
+        if _cache_size <= max_bytes:
+            return
+        entries = sorted(_scan())
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        _cache_size = total
+        logger.info('크기 변환 캐시를 %d바이트로 줄였습니다.', total)
+
+
+def _touch(path, mtime, now):
+    if now - mtime > TOUCH_INTERVAL:
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+
+def serve_resized(request, path, full_path, stat):
+    try:
+        width, fmt = parse_params(request.GET, path)
+    except ResizeError as e:
+        return HttpResponseBadRequest(str(e))
+
+    key = cache_key(path, stat, width, fmt)
+    output_path = cache_path(key, fmt)
+    etag = quote_etag(key)
+    if key in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        if not os.path.exists(output_path):
+            with _key_lock(key):
+                if not os.path.exists(output_path): # 기다리는 동안 다른 요청이 만들었으면 그걸 쓴다.
+                    try:
+                        _account(render(full_path, output_path, width, fmt))
+                    except (OSError, taskqueue.ImageTooLarge) as e:
+                        logger.warning('%s를 %d/%s로 바꾸지 못했습니다: %s', path, width, fmt, e)
+                        return HttpResponseBadRequest('사진을 변환할 수 없습니다.')
+        try:
+            cached = open(output_path, 'rb')
+        except OSError: # 열기 직전에 밀려났다. 드물기 때문에 다시 만들지 않고 한 번 더 요청하게 한다.
+            return HttpResponse(status=503)
+        cached_stat = os.fstat(cached.fileno())
+        _touch(output_path, cached_stat.st_mtime, time.time())
+        content_type = taskqueue.MIME_TYPES[FORMAT_EXTENSIONS[fmt][0]]
+        if request.method == 'HEAD':
+            cached.close()
+            response = HttpResponse(content_type=content_type)
+        else:
+            response = FileResponse(cached, content_type=content_type)
+        response['Content-Length'] = str(cached_stat.st_size)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if is_immutable_name(path):
+        max_age = getattr(settings, 'BLOG_RESIZE_MAX_AGE', 60 * 60 * 24 * 365)
+        response['Cache-Control'] = 'public, max-age={}, immutable'.format(max_age)
+    else: # 원본 이름이 그대로 내용이 바뀔 수 있으면 원본과 같은 시간만 캐시한다.
+        response['Cache-Control'] = 'public, max-age={}'.format(getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600))
+    return response
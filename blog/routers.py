@@ -0,0 +1,102 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+'''
+읽기는 복제본(settings.DATABASE_REPLICAS)으로, 쓰기는 주 DB(default)로 보내는 라우터.
+
+복제본은 주 DB보다 조금 늦으므로 쓴 직후의 읽기는 주 DB로 보낸다. (read-your-writes)
+    - 한 요청 안에서 쓰기가 있으면 그 뒤의 읽기는 모두 주 DB
+    - 쓰기가 있었던 요청의 응답에는 쿠키를 붙이고, 쿠키가 살아있는 동안(REPLICA_PIN_SECONDS)
+      그 사용자의 요청은 주 DB만 쓴다. 댓글을 달고 view_post로 돌아왔을 때 댓글이 보이도록.
+    - 요청 밖(태스크, 관리 명령)에서 방금 쓴 데이터를 읽을 때는 use_primary()로 감싼다.
+    - 상태는 스레드마다 있다. 미들웨어를 거치지 않고 스레드를 다시 쓰는 곳(태스크 큐 풀, ASGI 풀)은
+      작업 하나를 clean_state()로 감싸서 앞 작업의 쓰기 때문에 계속 주 DB만 읽는 일이 없게 한다.
+'''
+
+PIN_COOKIE = 'pin_primary'
+
+_state = threading.local()
+
+
+def replicas():
+    return [alias for alias in getattr(settings, 'DATABASE_REPLICAS', ()) if alias in settings.DATABASES]
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', 0) > 0 or getattr(_state, 'wrote', False)
+
+
+def reset():
+    _state.pinned = 0
+    _state.wrote = False
+
+
+@contextmanager
+def clean_state():
+    '''
+    새 요청처럼 시작하고, 끝나면 원래 상태로 돌려놓는다.
+    '''
+    saved = getattr(_state, 'pinned', 0), getattr(_state, 'wrote', False)
+    reset()
+    try:
+        yield
+    finally:
+        _state.pinned, _state.wrote = saved
+
+
+@contextmanager
+def use_primary():
+    _state.pinned = getattr(_state, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        _state.pinned -= 1
+
+
+class PrimaryReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        pool = replicas()
+        if not pool or is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS # 트랜잭션 안에서는 방금 쓴 것을 읽을 수 있어야 한다.
+        return random.choice(pool)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = set([DEFAULT_DB_ALIAS] + replicas())
+        if obj1._state.db in pool and obj2._state.db in pool: # 복제본도 같은 데이터다.
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas() # 복제본은 주 DB에서 복제로 따라온다.
+
+
+class ReplicaPinningMiddleware(object):
+    '''
+    세션 미들웨어보다 앞에 두어야 세션 저장(로그인)도 쓰기로 본다.
+    '''
+    def process_request(self, request):
+        reset()
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        if pinned_until > time.time():
+            _state.pinned = 1
+        return None
+
+    def process_response(self, request, response):
+        if getattr(_state, 'wrote', False) and replicas():
+            seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(PIN_COOKIE, '{:.0f}'.format(time.time() + seconds), max_age=seconds, httponly=True)
+        reset()
+        return response
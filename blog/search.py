@@ -0,0 +1,251 @@
+import re
+
+from django.db import connection, connections, OperationalError
+from django.db.models import Q
+
+from .pagination import KeysetPage, check_range, decode_cursor, InvalidCursor
+
+
+'''
+글 전문 검색 인덱스.
+SQLite는 FTS5 가상 테이블, MySQL은 ngram 파서를 쓰는 FULLTEXT 인덱스 테이블을 쓴다.
+둘 다 아니거나 FTS5가 없는 SQLite면 예전처럼 LIKE 검색으로 동작한다.
+
+한국어는 띄어쓰기 단위로 자르면 조사 때문에 검색이 잘 안 되므로 두 글자씩(bigram) 자른다.
+MySQL ngram 파서는 스스로 자르지만 FTS5의 unicode61 토크나이저는 못하므로
+SQLite에는 미리 bigram으로 자른 문자열을 넣는다.
+'''
+
+SQLITE_TABLE = 'blog_post_fts'
+MYSQL_TABLE = 'blog_post_search'
+TITLE_WEIGHT = 5.0 # 제목에 나온 단어가 본문보다 점수가 높도록
+
+_CJK = '\u1100-\u11ff\u3040-\u30ff\u3130-\u318f\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af' # 한글, 가나, 한자
+_TOKEN_RE = re.compile('([{cjk}]+)|([^\\W{cjk}]+)'.format(cjk=_CJK))
+
+_index_tables = {}
+
+
+def tokenize(text):
+    '''
+    '장고 튜토리얼 django' -> ['장고', '튜토', '토리', '리얼', 'django']
+    '''
+    tokens = []
+    for run, word in _TOKEN_RE.findall((text or '').lower()):
+        if word:
+            tokens.append(word)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _backend(conn=None):
+    '''
+    'sqlite', 'mysql' 또는 인덱스가 없으면 None
+    '''
+    conn = conn or connection
+    if conn.vendor not in ('sqlite', 'mysql'):
+        return None
+    key = (conn.alias, conn.settings_dict['NAME'])
+    if key not in _index_tables: # 테스트 DB처럼 이름이 바뀌면 다시 확인한다.
+        table = SQLITE_TABLE if conn.vendor == 'sqlite' else MYSQL_TABLE
+        _index_tables[key] = table in conn.introspection.table_names()
+    return conn.vendor if _index_tables[key] else None
+
+
+def create_index(schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE {} USING fts5(title, body, tokenize='unicode61')".format(SQLITE_TABLE)
+            )
+        except OperationalError: # FTS5 없이 빌드된 SQLite면 LIKE 검색을 쓴다.
+            return
+    elif conn.vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE TABLE {} ('
+            ' post_id INTEGER NOT NULL PRIMARY KEY,'
+            ' title VARCHAR(200) NOT NULL,'
+            ' body LONGTEXT NOT NULL,'
+            ' FULLTEXT KEY {}_ft (title, body) WITH PARSER ngram'
+            ') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4'.format(MYSQL_TABLE, MYSQL_TABLE)
+        )
+    _index_tables.clear()
+
+
+def drop_index(schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(SQLITE_TABLE))
+    elif conn.vendor == 'mysql':
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(MYSQL_TABLE))
+    _index_tables.clear()
+
+
+def index_posts(posts, using='default'):
+    '''
+    글들을 인덱스에 넣거나 고친다. post_save signal과 일괄 작업에서 같이 쓴다.
+    '''
+    conn = connections[using]
+    backend = _backend(conn)
+    if backend is None:
+        return
+    with conn.cursor() as cursor:
+        for post in posts:
+            if backend == 'sqlite':
+                cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(SQLITE_TABLE), [post.pk])
+                cursor.execute(
+                    'INSERT INTO {} (rowid, title, body) VALUES (%s, %s, %s)'.format(SQLITE_TABLE),
+                    [post.pk, ' '.join(tokenize(post.title)), ' '.join(tokenize(post.content))]
+                )
+            else:
+                cursor.execute(
+                    'REPLACE INTO {} (post_id, title, body) VALUES (%s, %s, %s)'.format(MYSQL_TABLE),
+                    [post.pk, post.title, post.content]
+                )
+
+
+def unindex_post(pk, using='default'):
+    conn = connections[using]
+    backend = _backend(conn)
+    if backend is None:
+        return
+    with conn.cursor() as cursor:
+        if backend == 'sqlite':
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(SQLITE_TABLE), [pk])
+        else:
+            cursor.execute('DELETE FROM {} WHERE post_id = %s'.format(MYSQL_TABLE), [pk])
+
+
+def _match_expression(query, backend):
+    terms = query.split()
+    if backend == 'sqlite':
+        parts = []
+        for term in terms:
+            tokens = tokenize(term)
+            for token in tokens:
+                # 한 글자 한글은 bigram 인덱스에 없으므로 접두어 검색으로 찾는다.
+                suffix = '*' if len(token) == 1 and re.match('[{}]'.format(_CJK), token) else ''
+                parts.append('"{}"{}'.format(token.replace('"', '""'), suffix))
+        return ' '.join(parts) # FTS5에서 공백은 AND
+    return ' '.join('+"{}"'.format(t.replace('"', '')) for t in terms if t.replace('"', ''))
+
+
+def _match_sql(backend):
+    '''
+    검색어(%s)에 맞는 글 id만 고르는 SQL. 개수 제한이 없다.
+    '''
+    if backend == 'sqlite':
+        return 'SELECT rowid FROM {t} WHERE {t} MATCH %s'.format(t=SQLITE_TABLE)
+    return 'SELECT post_id FROM {t} WHERE MATCH(title, body) AGAINST (%s IN BOOLEAN MODE)'.format(t=MYSQL_TABLE)
+
+
+def _ranked_sql(backend, seek, backwards, restrict=None):
+    '''
+    (rank, id) 순서로 정렬한 검색 결과를 반환하는 SQL.
+    score는 작을수록 관련도가 높다. (FTS5 bm25 규칙에 맞추려고 MySQL 점수는 음수로 바꾼다)
+    restrict는 글 id를 고르는 서브쿼리. LIMIT보다 먼저 걸러야 조건에 맞는 글이 빠지지 않는다.
+    '''
+    if backend == 'sqlite':
+        inner = (
+            'SELECT rowid AS id, bm25({t}, {w}, 1.0) AS score FROM {t} WHERE {t} MATCH %s'
+        ).format(t=SQLITE_TABLE, w=TITLE_WEIGHT)
+        if restrict:
+            inner += ' AND rowid IN ({})'.format(restrict)
+    else:
+        inner = (
+            'SELECT post_id AS id, -MATCH(title, body) AGAINST (%s IN BOOLEAN MODE) AS score'
+            ' FROM {t} WHERE MATCH(title, body) AGAINST (%s IN BOOLEAN MODE)'
+        ).format(t=MYSQL_TABLE)
+        if restrict:
+            inner += ' AND post_id IN ({})'.format(restrict)
+    op, order = ('<', 'DESC') if backwards else ('>', 'ASC')
+    where = ' WHERE score {op} %s OR (score = %s AND id {op} %s)'.format(op=op) if seek else ''
+    return 'SELECT id, score FROM ({}) ranked{} ORDER BY score {o}, id {o} LIMIT %s'.format(inner, where, o=order)
+
+
+class SearchPaginator(object):
+    '''
+    검색 결과를 관련도 (rank, pk) 순서의 커서로 자른다.
+    KeysetPaginator와 같은 KeysetPage를 돌려주므로 keyset_pagination.html을 그대로 쓴다.
+    '''
+    fields = ('rank', 'pk')
+
+    def __init__(self, queryset, query, per_page):
+        self.queryset = queryset
+        self.query = query.strip()
+        self.per_page = per_page
+
+    def key_of(self, obj):
+        return [obj.search_rank, obj.pk]
+
+    def fetch_rows(self, values, backwards, limit):
+        backend = _backend(connections[self.queryset.db])
+        match = _match_expression(self.query, backend) if backend else ''
+        if backend is None or not match.strip('"+* '):
+            return self._fetch_like(values, backwards, limit)
+
+        params = [match] if backend == 'sqlite' else [match, match]
+        restrict = None
+        if self.queryset.query.where: # 조건이 있는 queryset이면 그 글들 안에서만 순위를 매긴다.
+            ids = self.queryset.order_by().values('pk')
+            restrict, restrict_params = ids.query.get_compiler(using=self.queryset.db).as_sql()
+            params += list(restrict_params)
+        if values is not None:
+            params += [values[0], values[0], values[1]]
+        params.append(limit)
+        with connections[self.queryset.db].cursor() as cursor:
+            cursor.execute(_ranked_sql(backend, values is not None, backwards, restrict), params)
+            ranked = cursor.fetchall()
+
+        posts = self.queryset.in_bulk([pk for pk, rank in ranked])
+        rows = []
+        for pk, rank in ranked:
+            if pk in posts: # 인덱스와 queryset 조건이 어긋난 글은 뺀다.
+                post = posts[pk]
+                post.search_rank = rank
+                rows.append(post)
+        return rows
+
+    def _fetch_like(self, values, backwards, limit):
+        # 인덱스가 없을 때는 LIKE로 찾고 최신 글 순으로 보여준다. (rank = -pk)
+        if not self.query:
+            return []
+        qs = self.queryset.filter(Q(title__icontains=self.query) | Q(content__icontains=self.query))
+        if values is not None:
+            qs = qs.filter(pk__gt=values[1]) if backwards else qs.filter(pk__lt=values[1])
+        rows = list(qs.order_by('pk' if backwards else '-pk')[:limit])
+        for post in rows:
+            post.search_rank = -post.pk
+        return rows
+
+    def page(self, token=None):
+        if not token:
+            return KeysetPage(self, 'n', None)
+        direction, values = decode_cursor(token, len(self.fields))
+        try:
+            values = [float(values[0]), int(values[1])]
+            for v in values:
+                check_range(v)
+        except (TypeError, ValueError, OverflowError):
+            raise InvalidCursor(token)
+        return KeysetPage(self, direction, values)
+
+
+def filter_matching(queryset, query):
+    '''
+    queryset에서 검색어에 맞는 글만 남긴다. (admin 검색용)
+    인덱스 검색을 개수 제한 없는 서브쿼리로 넣으므로 changelist의 필터, 정렬, 페이지가 그대로 걸린다.
+    '''
+    query = query.strip()
+    conn = connections[queryset.db]
+    backend = _backend(conn)
+    match = _match_expression(query, backend) if backend else ''
+    if backend is None or not match.strip('"+* '):
+        return queryset.filter(Q(title__icontains=query) | Q(content__icontains=query))
+    meta = queryset.model._meta
+    column = '{}.{}'.format(conn.ops.quote_name(meta.db_table), conn.ops.quote_name(meta.pk.column))
+    return queryset.extra(where=['{} IN ({})'.format(column, _match_sql(backend))], params=[match])
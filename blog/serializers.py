@@ -0,0 +1,103 @@
+from rest_framework import serializers
+from rest_framework.reverse import reverse
+
+from .models import Post, Comment, Category, Tag
+
+
+'''
+JSON API (blog/api.py)의 시리얼라이저.
+시리얼라이저는 쿼리를 하지 않는다. 필요한 관계는 뷰의 queryset이 select_related / prefetch_related로 미리 가져온다.
+'''
+
+
+def split_param(value):
+    # 'id,title' -> {'id', 'title'}
+    return set(v.strip() for v in (value or '').split(',') if v.strip())
+
+
+class SparseFieldsMixin(object):
+    '''
+    context['fields']가 있으면 거기 적힌 필드만 남긴다. (?fields=id,title)
+    모르는 이름은 무시한다. 중첩된 시리얼라이저에는 적용되지 않는다.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        wanted = self.context.get('fields')
+        if wanted:
+            for name in set(self.fields) - set(wanted):
+                self.fields.pop(name)
+
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ('id', 'name')
+
+
+class TagSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = ('id', 'name')
+
+
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    user = serializers.CharField(source='user.username', read_only=True) # 뷰에서 select_related('user')
+    post = serializers.IntegerField(source='post_id', read_only=True) # 글을 다시 읽지 않는다.
+
+    class Meta:
+        model = Comment
+        fields = ('id', 'post', 'user', 'content', 'created_at', 'updated_at')
+
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+    user = serializers.CharField(source='user.username', read_only=True)
+    category = CategorySerializer(read_only=True)
+    tags = TagSerializer(source='tag', many=True, read_only=True) # 뷰에서 prefetch_related('tag')
+    photo = serializers.SerializerMethodField()
+    photos = serializers.SerializerMethodField()
+    comments_url = serializers.SerializerMethodField()
+    comments = CommentSerializer(source='embedded_comments', many=True, read_only=True) # 글 하나에 ?embed=comments일 때만 (최근 댓글)
+
+    class Meta:
+        model = Post
+        fields = (
+            'id', 'url', 'title', 'content', 'user', 'category', 'tags',
+            'photo', 'photos', 'created_at', 'updated_at', 'comments_url', 'comments',
+        )
+
+    def __init__(self, *args, **kwargs):
+        super(PostSerializer, self).__init__(*args, **kwargs)
+        if 'comments' not in self.context.get('embed', ()):
+            self.fields.pop('comments', None) # 댓글은 기본으로 링크(comments_url)만 준다.
+
+    def _absolute(self, url):
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_url(self, obj):
+        return reverse('api:post_detail', kwargs={'pk': obj.pk}, request=self.context.get('request'))
+
+    def get_comments_url(self, obj):
+        return reverse('api:post_comments', kwargs={'pk': obj.pk}, request=self.context.get('request'))
+
+    def get_photo(self, obj):
+        return self._absolute(obj.photo.url) if obj.photo else None
+
+    def get_photos(self, obj):
+        '''
+        해상도별 축소본. 앱이 화면 크기에 맞는 파일만 받도록 한다. (photo_variants 그대로, 쿼리 없음)
+        '''
+        renditions = obj.photo_renditions()
+        if renditions is None:
+            return []
+        storage = obj.photo.storage
+        return [
+            {
+                'url': self._absolute(storage.url(v['name'])),
+                'width': v['width'],
+                'height': v['height'],
+                'type': v['type'],
+            }
+            for v in sorted(renditions['variants'], key=lambda v: (v['width'], v['type']))
+        ]
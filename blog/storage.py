@@ -0,0 +1,150 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+REUSED_DIR = 'tmp/reused' # 다시 쓰인 원본의 표시 파일. (tmp/는 서빙하지도, reconcile_uploads가 보지도 않는다)
+HASHED_NAME_RE = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{2})/(\1\2[0-9a-f]{60})(\.[A-Za-z0-9]+)?$')
+
+
+def hashed_name(digest, ext):
+    '''
+    sha256 값으로 저장 이름을 만든다. 'abcdef...' -> 'ab/cd/abcdef....jpg'
+    한 폴더에 파일이 너무 많아지지 않도록 앞 네 글자로 두 단계 폴더를 나눈다.
+    '''
+    return '{}/{}/{}{}'.format(digest[:2], digest[2:4], digest, ext.lower())
+
+
+def is_hashed_name(name):
+    return bool(name and HASHED_NAME_RE.match(name))
+
+
+def is_immutable_name(name):
+    '''
+    이름이 곧 내용의 해시인 원본만 내용이 바뀌지 않는다.
+    축소본('_w320')은 같은 이름으로 다시 만들어질 수 있다. (BLOG_THUMBNAIL_QUALITY를 바꿨을 때 등)
+    '''
+    return is_hashed_name(name)
+
+
+class HashedFileSystemStorage(FileSystemStorage):
+    '''
+    내용의 sha256으로 이름을 붙이는 저장소.
+    같은 사진을 여러 번 올려도 파일은 하나만 남고, 파일 이름이 바뀌지 않으므로 오래 캐시할 수 있다.
+    몇 개의 글이 같은 파일을 쓰는지는 DB(Post.photo)로 센다. (delete_attached_immage 참고)
+
+    location과 base_url은 매번 settings에서 읽으므로 테스트의 override_settings도 따른다.
+    '''
+    def __init__(self, location=None, base_url=None, file_permissions_mode=None,
+                 directory_permissions_mode=None):
+        self._location = location
+        self._base_url = base_url
+        self._file_permissions_mode = file_permissions_mode
+        self._directory_permissions_mode = directory_permissions_mode
+
+    @property
+    def base_location(self):
+        return self._location or settings.MEDIA_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    @property
+    def base_url(self):
+        base_url = self._base_url or settings.MEDIA_URL
+        return base_url if base_url.endswith('/') else base_url + '/'
+
+    @property
+    def file_permissions_mode(self):
+        if self._file_permissions_mode is not None:
+            return self._file_permissions_mode
+        return settings.FILE_UPLOAD_PERMISSIONS
+
+    @property
+    def directory_permissions_mode(self):
+        if self._directory_permissions_mode is not None:
+            return self._directory_permissions_mode
+        return settings.FILE_UPLOAD_DIRECTORY_PERMISSIONS
+
+    def get_available_name(self, name, max_length=None):
+        # 실제 이름은 내용을 다 읽은 뒤 _save에서 정한다. 같은 이름이면 같은 내용이므로 겹쳐도 된다.
+        return name
+
+    def _makedirs(self, directory):
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError: # 다른 요청이 동시에 만든 경우
+                if not os.path.isdir(directory):
+                    raise
+            if self.directory_permissions_mode is not None:
+                os.chmod(directory, self.directory_permissions_mode)
+
+    def _reused_marker(self, name):
+        # 해시만으로 겹치지 않는다. 확장자를 빼서 축소본 이름('_w320.webp')에서도 원본의 표시를 찾는다.
+        return self.path('{}/{}'.format(REUSED_DIR, os.path.splitext(os.path.basename(name))[0]))
+
+    def mark_reused(self, name):
+        '''
+        같은 사진이 다시 올라와 name을 다시 쓴다고 표시한다. 사진의 mtime은 축소본과 크기 바꾼 캐시가
+        기준으로 쓰므로 건드리지 않고, 따로 둔 표시 파일의 mtime을 올린다.
+        '''
+        path = self._reused_marker(name)
+        self._makedirs(os.path.dirname(path))
+        with open(path, 'a'):
+            os.utime(path, None)
+
+    def reused_since(self, name, when):
+        try:
+            return os.path.getmtime(self._reused_marker(name)) > when
+        except OSError:
+            return False
+
+    def clear_reused(self, name):
+        try:
+            os.remove(self._reused_marker(name))
+        except OSError:
+            pass
+
+    def _save(self, name, content):
+        '''
+        업로드를 임시 파일로 흘려 쓰면서 해시를 계산하고, 다 쓰면 해시 이름으로 옮긴다.
+        이미 같은 파일이 있으면 임시 파일을 버리고 있는 파일 이름을 돌려준다.
+        이때 mark_reused로 표시해서, 그 파일을 지우려던 정리 작업(taskqueue.delete_photo_files,
+        reconcile_uploads)이 아직 글이 저장되기 전이라도 건너뛰게 한다.
+        '''
+        tmp_dir = self.path('tmp')
+        self._makedirs(tmp_dir)
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    if not isinstance(chunk, bytes):
+                        chunk = chunk.encode('utf-8')
+                    hasher.update(chunk)
+                    f.write(chunk)
+
+            name = hashed_name(hasher.hexdigest(), os.path.splitext(name)[1])
+            full_path = self.path(name)
+            reused = os.path.exists(full_path)
+            if reused:
+                self.mark_reused(name)
+                reused = os.path.exists(full_path) # 표시하기 전에 지워졌으면 새로 옮긴다.
+            if reused:
+                os.remove(tmp_path)
+            else:
+                self._makedirs(os.path.dirname(full_path))
+                os.rename(tmp_path, full_path) # 같은 파일시스템 안이므로 원자적으로 옮겨진다.
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
@@ -0,0 +1,56 @@
+from django import template
+
+from ..caching import fragment_key, get_or_render
+
+
+register = template.Library()
+
+
+class CacheFragmentNode(template.Node):
+    def __init__(self, nodelist, name, namespaces, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.namespaces = namespaces
+        self.vary_on = vary_on
+
+    def render(self, context):
+        namespaces = []
+        for ns in self.namespaces: # 변수가 리스트면 (예: post.cache_namespaces) 펼쳐서 넣는다.
+            value = ns.resolve(context)
+            if isinstance(value, (list, tuple)):
+                namespaces.extend(value)
+            else:
+                namespaces.append(value)
+        key = fragment_key(
+            self.name.resolve(context),
+            namespaces,
+            [v.resolve(context) for v in self.vary_on],
+        )
+        return get_or_render(key, lambda: self.nodelist.render(context))
+
+
+@register.tag('cachefragment')
+def do_cachefragment(parser, token):
+    '''
+    {% cachefragment "이름" on "list" post.cache_namespaces key request.GET.cursor %}
+        ...
+    {% endcachefragment %}
+
+    on 뒤는 무효화 네임스페이스, key 뒤는 같은 네임스페이스 안에서 조각을 구분할 값이다.
+    '''
+    bits = token.split_contents()
+    if len(bits) < 4 or bits[2] != 'on':
+        raise template.TemplateSyntaxError(
+            "'{}' 태그는 이름과 on 뒤의 네임스페이스가 필요합니다.".format(bits[0])
+        )
+    name = parser.compile_filter(bits[1])
+    namespaces, vary_on = [], []
+    target = namespaces
+    for bit in bits[3:]:
+        if bit == 'key':
+            target = vary_on
+            continue
+        target.append(parser.compile_filter(bit))
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+    return CacheFragmentNode(nodelist, name, namespaces, vary_on)
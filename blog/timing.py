@@ -0,0 +1,151 @@
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+from django.dispatch import receiver
+
+
+'''
+요청별 SQL / 템플릿 / 뷰 시간을 Server-Timing 헤더로 내보내는 미들웨어.
+    settings.SERVER_TIMING_SAMPLE_RATE : 잴 요청의 비율 (0이면 끔, 1이면 모든 요청). DEBUG와 상관없다.
+    settings.SERVER_TIMING_SLOW_MS     : 이보다 오래 걸린 요청은 가장 느린 쿼리들과 함께 로그를 남긴다.
+
+장고 1.9에는 커넥션 execute wrapper가 없으므로 잴 요청에서만 force_debug_cursor를 켜서
+커넥션의 queries_log(쿼리 문장과 시간)를 쓴다.
+'''
+
+logger = logging.getLogger('blog.timing')
+
+_local = threading.local()
+
+# 세션과 로그인 사용자를 읽는 쿼리는 'auth'로 따로 센다.
+AUTH_TABLES = ('django_session', 'auth_user')
+
+
+class RequestTiming(object):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.template = 0.0
+        self.template_depth = 0
+        self.connections = []
+        for conn in connections.all():
+            self.connections.append((conn, conn.force_debug_cursor, len(conn.queries_log)))
+            conn.force_debug_cursor = True
+
+    def finish(self):
+        '''
+        켜두었던 force_debug_cursor를 되돌리고 이 요청에서 실행된 쿼리들을 돌려준다.
+        '''
+        queries = []
+        for conn, saved, start in self.connections:
+            # queries_log는 요청이 시작될 때마다 비워지므로 (reset_queries) 보통 start는 0이다.
+            for q in list(conn.queries_log)[start:]:
+                queries.append((float(q['time']), conn.alias, q['sql']))
+            conn.force_debug_cursor = saved
+        self.connections = []
+        return queries
+
+
+def _is_auth_query(sql):
+    return any(table in sql for table in AUTH_TABLES)
+
+
+def install_template_timer():
+    '''
+    템플릿 백엔드의 render를 감싸서 잴 요청일 때만 렌더링 시간을 더한다.
+    include는 백엔드를 거치지 않으므로 바깥 템플릿 시간에 들어간다.
+    '''
+    from django.template.backends.django import Template
+    if getattr(Template.render, '_timed', False):
+        return
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        timing = getattr(_local, 'timing', None)
+        if timing is None:
+            return original(self, context, request)
+        timing.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            timing.template_depth -= 1
+            if timing.template_depth == 0: # 템플릿 안에서 render_to_string을 불러도 두 번 세지 않는다.
+                timing.template += time.perf_counter() - started
+
+    render._timed = True
+    Template.render = render
+
+
+def _metric(name, seconds, desc=None):
+    value = '{};dur={:.1f}'.format(name, seconds * 1000.0)
+    if desc:
+        value += ';desc="{}"'.format(desc)
+    return value
+
+
+class ServerTimingMiddleware(object):
+    '''
+    MIDDLEWARE_CLASSES의 맨 앞에 두어야 세션/인증 미들웨어 시간까지 total에 들어간다.
+    '''
+    def __init__(self):
+        install_template_timer()
+
+    def process_request(self, request):
+        rate = getattr(settings, 'SERVER_TIMING_SAMPLE_RATE', 0)
+        if rate <= 0 or random.random() >= rate:
+            return None
+        request._server_timing = _local.timing = RequestTiming()
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing = getattr(request, '_server_timing', None)
+        if timing is not None:
+            timing.view_started = time.perf_counter()
+        return None
+
+    def process_response(self, request, response):
+        timing = getattr(request, '_server_timing', None)
+        if timing is None:
+            return response
+        ended = time.perf_counter()
+        _local.timing = None
+        queries = timing.finish()
+
+        db = sum(t for t, alias, sql in queries)
+        auth = sum(t for t, alias, sql in queries if _is_auth_query(sql))
+        total = ended - timing.started
+        metrics = [
+            _metric('db', db - auth, '{} queries'.format(len(queries))),
+            _metric('auth', auth),
+            _metric('tpl', timing.template),
+        ]
+        if timing.view_started is not None:
+            metrics.append(_metric('view', ended - timing.view_started))
+        metrics.append(_metric('total', total))
+        response['Server-Timing'] = ', '.join(metrics)
+
+        if total * 1000.0 >= getattr(settings, 'SERVER_TIMING_SLOW_MS', 500):
+            match = getattr(request, 'resolver_match', None)
+            worst = sorted(queries, reverse=True)[:getattr(settings, 'SERVER_TIMING_WORST_QUERIES', 3)]
+            logger.warning(
+                '느린 요청 %s (%s %s) %.1fms: 쿼리 %d개 %.1fms, 템플릿 %.1fms\n%s',
+                match.view_name if match else '-', request.method, request.path,
+                total * 1000.0, len(queries), db * 1000.0, timing.template * 1000.0,
+                '\n'.join('  {:.1f}ms [{}] {}'.format(t * 1000.0, alias, sql) for t, alias, sql in worst),
+            )
+        return response
+
+
+@receiver(request_finished)
+def _finish_abandoned_timing(sender, **kwargs):
+    # 예외 등으로 process_response를 거치지 않은 요청도 force_debug_cursor는 되돌려 놓는다.
+    timing = getattr(_local, 'timing', None)
+    if timing is not None:
+        _local.timing = None
+        timing.finish()
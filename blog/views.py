@@ -1,66 +1,191 @@
 
+import json
+
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import Http404, HttpResponse
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.core.urlresolvers import reverse
+from django.utils.http import urlencode
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.core.exceptions import PermissionDenied
 
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import condition, require_POST
+from django.views.decorators.vary import vary_on_headers
 
+from . import live
 from .models import Post, Comment, Category, Tag
-from .forms import PostEditForm
+from .forms import PostEditForm, CommentForm
+from .pagination import KeysetPaginator, InvalidCursor
+from .search import SearchPaginator
+from .conditional import load_post, list_posts_etag, view_post_etag, view_post_last_modified
 
-from taskqueue import make_thumbnail
+from taskqueue import make_post_thumbnails
 
 
 def hello(request):
     return HttpResponse('hello world')
 
+def comment_page(post_pk, cursor):
+    '''
+    글의 댓글을 오래된 것부터 (created_at, pk) 순서로 BLOG_COMMENTS_PER_PAGE개씩 자른다.
+    (post, created_at, id) 인덱스 범위 스캔 한 번이므로 댓글이 많아도 페이지마다 비용이 같다.
+    '''
+    comments = Comment.objects.filter(post_id=post_pk).select_related('user') # 댓글마다 글쓴이를 따로 가져오지 않도록 조인한다.
+    pagi = KeysetPaginator(comments, getattr(settings, 'BLOG_COMMENTS_PER_PAGE', 50), ordering=('created_at', 'pk'))
+    try:
+        return pagi.page(cursor)
+    except InvalidCursor:
+        raise Http404("해당 페이지가 존재하지 않습니다.")
+
+@condition(etag_func=list_posts_etag) # 바뀐 게 없으면 304
 def list_posts(request):
     per_page = 3
-    current_page = int(request.GET.get('page', 1)) # page가 있으면 값을 가져오고 없으면 1을 가져온다.
+    cursor = request.GET.get('cursor') # 커서가 없으면 첫 페이지
 
-    all_posts = Post.objects.select_related().prefetch_related().all()
+    all_posts = Post.objects.select_related('user', 'category') # 목록에서 글쓴이와 카테고리 이름을 쓰므로 한 번에 조인한다.
+    all_posts = all_posts.defer('content', 'content_html') # 목록은 미리 잘라둔 excerpt만 읽는다.
 
-    pagi = Paginator(all_posts, per_page)
+    pagi = KeysetPaginator(all_posts, per_page) # Post.Meta.ordering (-created_at, -pk) 순서로 자른다.
     try:
-        pg = pagi.page(current_page)
-    except PageNotAnInteger:
-        pg = pagi.page(1)
-    except EmptyPage:
-        pg = []
+        pg = pagi.page(cursor)
+    except InvalidCursor:
         raise Http404("해당 페이지가 존재하지 않습니다.") # 404 에러 페이지로 이동
 
     return render(request, 'list_posts.html', {
         'posts': pg,
     })
 
+def search_posts(request):
+    per_page = 10
+    query = request.GET.get('q', '').strip()
+
+    posts = Post.objects.select_related('user', 'category').defer('content', 'content_html')
+    pagi = SearchPaginator(posts, query, per_page) # 관련도 순
+    try:
+        pg = pagi.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        raise Http404("해당 페이지가 존재하지 않습니다.")
+
+    return render(request, 'search_posts.html', {
+        'query': query,
+        'posts': pg,
+        'pagination_query': urlencode({'q': query}) + '&', # 다음 페이지에서도 검색어를 유지한다.
+    })
+
+@condition(etag_func=view_post_etag, last_modified_func=view_post_last_modified)
 def view_post(request, pk):
-    the_post = get_object_or_404(Post, pk=pk)
-    the_comment = Comment.objects.filter(post=the_post)
+    the_post = load_post(request, pk) # ETag를 계산하면서 이미 읽어둔 글
+    if the_post is None:
+        raise Http404("해당 글이 존재하지 않습니다.")
+    if request.method == 'POST': # 예전 댓글 폼 주소. create_comment와 똑같이 처리한다.
+        return create_comment(request, the_post.pk)
 
-    if request.method == 'GET':
-        pass
-    elif request.method == 'POST':
-        new_comment = Comment()
-        new_comment.content = request.POST.get('content')
-        new_comment.post = the_post
-
-        if new_comment.content == '': # 내용이 없는 댓글은 달리지 않는다. 하지만 스페이스를 입력하면 댓글이 달림..
-            raise PermissionDenied
-        elif new_comment.content.isspace(): # 스페이스를 입력하면 댓글이 달리지 않는다
-            raise PermissionDenied
-        elif not request.user.is_authenticated():
-            return redirect('login_url')
-        else:
-            new_comment.user = request.user
-            new_comment.save()
-            return redirect('view_post', pk=the_post.pk)
+    # 댓글은 한 페이지만 그린다. 다음 페이지는 '댓글 더 보기'가 list_comments에서 이어서 가져온다.
+    # 페이지는 처음 순회할 때 쿼리하므로 댓글 조각 캐시가 맞으면 이 쿼리 자체를 건너뛴다.
+    the_comments = comment_page(the_post.pk, request.GET.get('cursor'))
 
     return render(request, 'view_post.html', {
         'post': the_post,
-        'comment': the_comment,
+        'comments': the_comments,
+        'live_enabled': getattr(settings, 'BLOG_LIVE_ENABLED', False),
     })
 
+def wants_json(request):
+    return request.GET.get('format') == 'json' or 'application/json' in request.META.get('HTTP_ACCEPT', '')
+
+@require_POST
+@vary_on_headers('Accept') # Accept에 따라 줄 HTML이나 JSON을 돌려준다.
+def create_comment(request, pk):
+    '''
+    댓글 달기. 폼이나 JSON 본문({"content": ...})을 받는다.
+    스크립트(AJAX)로 부르면 새 댓글 한 줄의 HTML (JSON을 원하면 JSON)과 댓글 수만 돌려주고,
+    스크립트 없는 폼이면 예전처럼 글 보기로 돌아간다.
+    '''
+    post = get_object_or_404(Post.objects.only('pk'), pk=pk)
+    is_json = request.META.get('CONTENT_TYPE', '').split(';')[0] == 'application/json'
+    is_ajax = request.is_ajax() or is_json or wants_json(request)
+
+    if not request.user.is_authenticated():
+        if is_ajax:
+            return JsonResponse({'login_url': settings.LOGIN_URL}, status=403)
+        return redirect('login_url')
+
+    if is_json:
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            return JsonResponse({'errors': {'content': ['JSON 형식이 아닙니다.']}}, status=400)
+        form = CommentForm(data if isinstance(data, dict) else {})
+    else:
+        form = CommentForm(request.POST)
+    if not form.is_valid():
+        if is_ajax:
+            return JsonResponse({'errors': form.errors}, status=400)
+        raise PermissionDenied # 내용이 없거나 스페이스만 있는 댓글은 달리지 않는다.
+
+    comment = form.save(commit=False)
+    comment.post = post
+    comment.user = request.user
+    comment.save()
+    if not is_ajax:
+        return redirect(reverse('view_post', kwargs={'pk': post.pk}) + '#comments')
+
+    count = Post.objects.filter(pk=post.pk).values_list('comment_count', flat=True).first() # signal이 방금 올린 값
+    if is_json or wants_json(request):
+        return JsonResponse({'comment': comment.as_dict(), 'count': count}, status=201)
+    response = render(request, 'comment_row.html', {'comment': comment}, status=201)
+    response['X-Comment-Count'] = str(count)
+    return response
+
+@vary_on_headers('Accept') # 같은 URL에서 Accept에 따라 HTML 조각이나 JSON을 준다.
+def list_comments(request, pk):
+    '''
+    댓글 다음 페이지 조각. ?format=json이거나 JSON을 원하면 JSON, 아니면 댓글 줄들의 HTML을 돌려준다.
+    '''
+    post = Post.objects.filter(pk=pk).values('pk', 'comment_count').first()
+    if post is None:
+        raise Http404("해당 글이 존재하지 않습니다.")
+    page = comment_page(post['pk'], request.GET.get('cursor'))
+    next_url = None
+    if page.next_token:
+        next_url = '{}?{}'.format(reverse('list_comments', kwargs={'pk': post['pk']}), urlencode({'cursor': page.next_token}))
+
+    if wants_json(request):
+        return JsonResponse({
+            'count': post['comment_count'],
+            'next': next_url,
+            'comments': [comment.as_dict() for comment in page],
+        })
+    return render(request, 'comment_rows.html', {
+        'post_pk': post['pk'],
+        'comments': page,
+    })
+
+def post_events(request, pk):
+    '''
+    글의 새 댓글을 Server-Sent Events(text/event-stream)로 보낸다. (blog/live.py)
+    다시 연결할 때 브라우저가 보내는 Last-Event-ID (또는 ?last_event_id) 다음 댓글부터 이어서 보낸다.
+    '''
+    if not Post.objects.filter(pk=pk).exists():
+        raise Http404("해당 글이 존재하지 않습니다.")
+    last_event_id = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_event_id') or ''
+    if not last_event_id.isdigit():
+        last_event_id = 0
+
+    if not live.hub.acquire_stream(): # 열린 스트림이 너무 많다. 브라우저는 retry 뒤 다시 연결한다.
+        response = HttpResponse('잠시 후 다시 연결하세요.', status=503)
+        response['Retry-After'] = str(getattr(settings, 'BLOG_LIVE_RETRY_MS', 3000) // 1000 or 1)
+        return response
+    try:
+        stream = live.EventStream(int(pk), int(last_event_id))
+    except Exception:
+        live.hub.release_stream()
+        raise
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # nginx가 모았다가 보내지 않게 한다.
+    return response
+
 @login_required
 def create_post(request):
     if request.method == 'GET':
@@ -73,8 +198,8 @@ def create_post(request):
             new_post.save()
             if new_post.photo == None: # 사진이 없으면 그냥 넘어가고
                 return redirect('view_post', pk=new_post.pk)
-            else: # 사진이 있으면 썸네일 만들기
-                make_thumbnail.delay(new_post.photo.path, 100, 100)
+            else: # 사진이 있으면 해상도별 축소본 만들기
+                make_post_thumbnails.delay(new_post.pk)
                 return redirect('view_post', pk=new_post.pk)
 
     return render(request, 'create_post.html', {
@@ -0,0 +1,237 @@
+"""
+ASGI config for myweb project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+    uvicorn myweb.asgi:application --workers 2                          # myweb.settings
+    MYWEB_ENV=production MYWEB_DB_PW=... uvicorn myweb.asgi:application  # myweb.production_settings
+
+Environment:
+    DJANGO_SETTINGS_MODULE  settings module. If unset, chosen from MYWEB_ENV like myweb/wsgi.py,
+                            or myweb.settings (the manage.py default) when MYWEB_ENV is unset too.
+    MYWEB_ENV               'production' -> myweb.production_settings
+    MYWEB_DB_PW, MYWEB_DB_CONN_MAX_AGE, MYWEB_DB_REPLICA_HOSTS
+                            database settings read by production_settings
+    BLOG_LIVE_ENABLED       defaults to '1' here, so view_post opens the live comment stream.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+# 장고를 불러오기 전에 설정을 고른다. myweb/wsgi.py는 MYWEB_ENV가 없으면 설정 모듈 이름을 만들지 못한다.
+if not os.environ.get('MYWEB_ENV'):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myweb.settings')
+os.environ.setdefault('BLOG_LIVE_ENABLED', '1') # 스트림이 스레드를 붙잡지 않으므로 글 보기가 새 댓글 스트림을 연다.
+
+from django.conf import settings
+from django.core.urlresolvers import Resolver404, resolve
+
+from .wsgi import application as wsgi_application
+from blog.routers import clean_state
+
+
+'''
+장고 1.9에는 ASGI 핸들러도 async 뷰도 없으므로, WSGI 앱(myweb/wsgi.py)을 그대로 감싼다.
+    - 요청 본문(사진 업로드)은 이벤트 루프가 받는다. 느린 업로드가 스레드를 붙잡지 않는다.
+    - 뷰(글 목록, 글 보기, 댓글 달기/목록 ...)와 DB 접근은 ASGI_THREADS개짜리 스레드 풀에서 돈다.
+      스레드마다 DB 연결이 하나이므로 연결 수도 풀 크기를 넘지 않는다.
+    - 풀을 기다리는 요청이 ASGI_MAX_PENDING개를 넘으면 503으로 바로 돌려보낸다. (끝없이 줄 서지 않는다)
+    - 새 댓글 스트림(post_events)은 루프에서 기다린다. (blog.live.AsyncEventStream) 놓친 댓글을 읽을 때만 풀을 쓴다.
+      이 경로는 미들웨어를 거치지 않는다. (세션도 로그인도 쓰지 않는 공개 스트림이다)
+'''
+
+STREAM_ROUTES = ('post_events',)
+
+
+def _latin1(value):
+    return value.decode('latin1') if isinstance(value, bytes) else value
+
+
+def build_environ(scope, body):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'), # WSGI PATH_INFO는 UTF-8 바이트를 latin-1로 읽은 문자열이다.
+        'QUERY_STRING': _latin1(scope.get('query_string', b'')),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1] or 80)
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        key = _latin1(name).upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = _latin1(value)
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def _call_clean(func, *args):
+    # 풀 스레드는 요청/스트림 정리를 번갈아 맡는다. 미들웨어 밖에서 도는 일도 앞 작업의 DB 라우팅 상태를 이어받지 않는다.
+    with clean_state():
+        return func(*args)
+
+
+def call_wsgi(app, environ):
+    '''
+    풀 스레드에서 WSGI 앱을 부른다. 보통 응답은 본문까지 다 만들고 같은 스레드에서 닫는다.
+    (request_finished가 이 스레드의 DB 연결을 정리한다) 스트리밍 응답은 이터레이터를 그대로 돌려준다.
+    '''
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+        return lambda data: None # 장고는 write()를 쓰지 않는다.
+
+    result = app(environ, start_response)
+    if getattr(result, 'streaming', False):
+        return started['status'], started['headers'], None, result
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started['status'], started['headers'], body, None
+
+
+class ASGIApplication(object):
+    def __init__(self, wsgi_app, max_workers=None, max_pending=None):
+        self.wsgi_app = wsgi_app
+        self.max_workers = max_workers or getattr(settings, 'ASGI_THREADS', 8)
+        self.max_pending = max_pending or getattr(settings, 'ASGI_MAX_PENDING', 200)
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='asgi')
+        self.pending = 0 # 루프 스레드에서만 바꾼다.
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('처리할 수 없는 ASGI scope: {}'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.pool.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run_sync(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.pool, _call_clean, func, *args)
+
+    async def http(self, scope, receive, send):
+        try:
+            match = resolve(scope['path'])
+        except Resolver404:
+            match = None
+        if match is not None and match.url_name in STREAM_ROUTES and scope['method'] == 'GET':
+            return await self.live_events(scope, receive, send, match.kwargs['pk'])
+
+        if self.pending >= self.max_pending: # 풀이 밀려 있다. 본문을 받기 전에 돌려보낸다.
+            return await self.simple_response(send, 503, b'Service Unavailable', [(b'retry-after', b'1')])
+        self.pending += 1
+        try:
+            body = await self.read_body(receive)
+            status, headers, content, stream = await self.run_sync(call_wsgi, self.wsgi_app, build_environ(scope, body))
+        finally:
+            self.pending -= 1
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if stream is None:
+            await send({'type': 'http.response.body', 'body': content})
+            return
+        # 업로드 파일, 크기를 바꾼 사진 같은 스트리밍 응답은 조각마다 풀에서 읽는다.
+        chunks = iter(stream)
+        try:
+            while True:
+                chunk = await self.run_sync(next, chunks, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await self.run_sync(stream.close) # 다른 풀 스레드에서 닫힐 수 있다. 요청 스레드의 연결은 다음 요청 시작 때 정리된다.
+
+    async def read_body(self, receive):
+        # 큰 본문(사진)은 메모리 대신 임시 파일에 받는다.
+        body = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body
+
+    async def simple_response(self, send, status, body, headers=()):
+        await send({
+            'type': 'http.response.start', 'status': status,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8')] + list(headers),
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def live_events(self, scope, receive, send, pk):
+        from blog import live
+        from blog.models import Post
+
+        last_event_id = dict(scope.get('headers', [])).get(b'last-event-id', b'').decode('latin1')
+        if not last_event_id:
+            last_event_id = parse_qs(_latin1(scope.get('query_string', b''))).get('last_event_id', [''])[0]
+        last_event_id = int(last_event_id) if last_event_id.isdigit() else 0
+
+        if not await self.run_sync(lambda: Post.objects.filter(pk=pk).exists()):
+            return await self.simple_response(send, 404, '해당 글이 존재하지 않습니다.'.encode('utf-8'))
+        if not live.hub.acquire_stream():
+            retry_after = str(getattr(settings, 'BLOG_LIVE_RETRY_MS', 3000) // 1000 or 1).encode('latin1')
+            return await self.simple_response(send, 503, '잠시 후 다시 연결하세요.'.encode('utf-8'), [(b'retry-after', retry_after)])
+
+        try:
+            stream = live.AsyncEventStream(int(pk), last_event_id, loop=asyncio.get_event_loop())
+        except Exception:
+            live.hub.release_stream()
+            raise
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            preamble = await self.run_sync(stream.preamble)
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await send({'type': 'http.response.body', 'body': b''.join(preamble), 'more_body': True})
+            async for chunk in stream.events():
+                if disconnected.done():
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            stream.close()
+
+    async def wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+
+application = ASGIApplication(wsgi_application)
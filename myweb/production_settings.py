@@ -28,9 +28,12 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'blog',
     'bootstrap3',
+    'rest_framework',
 ]
 
 MIDDLEWARE_CLASSES = [
+    'blog.timing.ServerTimingMiddleware', # 맨 앞에 있어야 다른 미들웨어 시간까지 잰다.
+    'blog.routers.ReplicaPinningMiddleware', # 세션 저장도 쓰기로 보도록 세션 미들웨어보다 앞에
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,9 +79,53 @@ DATABASES = {
         'HOST': 'jake.cck1yrcarnkf.ap-northeast-1.rds.amazonaws.com',
         'USER': 'admin',
         'PASSWORD': os.environ.get('MYWEB_DB_PW'),
+        'CONN_MAX_AGE': int(os.environ.get('MYWEB_DB_CONN_MAX_AGE', 60)), # 연결을 요청 사이에 다시 쓴다. (초)
     }
 }
 
+# 읽기 전용 복제본. MYWEB_DB_REPLICA_HOSTS에 쉼표로 주소를 적으면 replica1, replica2 ... 로 추가된다.
+DATABASE_REPLICAS = []
+for i, host in enumerate(h for h in os.environ.get('MYWEB_DB_REPLICA_HOSTS', '').split(',') if h.strip()):
+    alias = 'replica{}'.format(i + 1)
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+# DB 연결 설정 (blog/dbtuning.py)
+# SQLite 연결마다 실행할 PRAGMA. None인 항목은 실행하지 않는다.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -16000, # KB
+    'mmap_size': 128 * 1024 * 1024,
+    'busy_timeout': 5000, # ms
+    'temp_store': 'memory',
+}
+DB_HEALTH_CHECK_INTERVAL = 30 # CONN_MAX_AGE로 다시 쓰는 연결을 확인하는 간격(초). None이면 확인하지 않는다.
+
+# 읽기/쓰기 DB 나누기 (blog/routers.py)
+DATABASE_ROUTERS = ['blog.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = 5 # 쓰기가 있었던 사용자의 읽기를 이 시간(초) 동안 주 DB로 보낸다.
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'myweb',
+    }
+}
+
+# 글 목록/글 보기 조각 캐시 (blog/caching.py)
+# locmem은 프로세스마다 따로라서 무효화가 다른 워커에 전달되지 않는다.
+# 워커가 여러 개면 memcached 같은 공유 캐시를 CACHES에 추가하고 그 이름을 지정할 것.
+BLOG_CACHE_ALIAS = 'default'
+BLOG_CACHE_TIMEOUT = 300
+
+BLOG_COMMENTS_PER_PAGE = 50 # 글 보기에서 한 번에 보여주는 댓글 수
+BLOG_ADMIN_COUNT_THRESHOLD = 10000 # admin 글 목록에서 이보다 많으면 정확히 세지 않고 어림한다.
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -129,6 +176,64 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/uploads/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'upload_files')
 
+# 업로드 파일 전송 (blog/media.py)
+# None이면 장고가 직접 보내고, 'x-sendfile' 또는 'x-accel-redirect'면 앞단 웹서버에 맡긴다.
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-uploads/' # nginx의 internal location
+MEDIA_CACHE_MAX_AGE = 60 * 60 # 해시 이름이 아닌 파일의 캐시 시간(초)
+
+# 사진 축소본 너비 목록과 WebP 생성 여부 (taskqueue.make_thumbnail)
+BLOG_THUMBNAIL_SIZES = (320, 640, 1024, 1600)
+BLOG_THUMBNAIL_WEBP = True
+BLOG_THUMBNAIL_QUALITY = 85
+# 이보다 큰 사진은 올릴 수 없고 축소본도 만들지 않는다. (압축 폭탄 방지, taskqueue.check_image_budget)
+BLOG_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+BLOG_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+# /uploads/<path>?w=320&fmt=webp 로 그때그때 크기를 바꾼 사진 (blog/resize.py)
+BLOG_RESIZE_WIDTHS = (160, 320, 640, 1024, 1600) # 이 너비만 받는다.
+BLOG_RESIZE_FORMATS = ('jpeg', 'png', 'webp')
+BLOG_RESIZE_CACHE_DIR = os.path.join(BASE_DIR, 'resize_cache')
+BLOG_RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024 # 넘으면 오래 안 쓴 파일부터 지운다.
+BLOG_CLEANUP_BATCH_SIZE = 100 # 글을 지운 뒤 사진 파일 삭제 태스크 하나가 맡는 원본 수 (blog/cleanup.py)
+# 새 댓글 실시간 스트림 /post/<pk>/live/ (blog/live.py)
+# 글 보기가 스트림을 열지 정한다. myweb/asgi.py가 켠다. WSGI에서는 스트림 하나가 워커 스레드 하나를 붙잡으므로 끈다.
+BLOG_LIVE_ENABLED = os.environ.get('BLOG_LIVE_ENABLED') == '1'
+BLOG_LIVE_BACKEND = 'blog.live.RedisBackend' # 워커 프로세스 사이에 새 댓글을 나른다.
+BLOG_LIVE_REDIS_URL = 'redis://localhost:6379/1'
+BLOG_LIVE_MAX_CONNECTIONS = 100 # 프로세스마다 열어 둘 수 있는 스트림 수. 넘으면 503
+BLOG_LIVE_HEARTBEAT = 15 # 초. 새 댓글이 없어도 이 간격으로 주석 줄을 보낸다.
+BLOG_LIVE_MAX_SECONDS = 300 # 초. 스트림 하나를 이만큼 연 뒤 끊는다. 브라우저가 이어서 다시 연결한다.
+BLOG_LIVE_RETRY_MS = 3000 # 끊긴 뒤 브라우저가 다시 연결하기까지 기다리는 시간
+BLOG_LIVE_QUEUE_SIZE = 100 # 스트림마다 쌓아 둘 수 있는 이벤트 수. 넘으면 끊고 다시 연결해 DB에서 따라잡는다.
+
+# 태스크 큐 (taskqueue.py)
+# 'auto'는 celery로 보내다가 브로커에 닿지 않으면 이 프로세스의 스레드 풀에서 실행한다.
+TASKQUEUE_BACKEND = 'auto'
+TASKQUEUE_BROKER_URL = 'redis://localhost:6379/0'
+TASKQUEUE_BROKER_TIMEOUT = 1.0 # 초
+TASKQUEUE_BROKER_RETRY = 30 # 브로커 연결에 실패하면 이 시간(초) 동안은 로컬 풀만 쓴다.
+TASKQUEUE_WORKERS = 2
+TASKQUEUE_MAX_PENDING = 100
+TASKQUEUE_SUBMIT_TIMEOUT = 0.5 # 로컬 풀이 가득 찼을 때 기다리는 시간(초). 넘기면 부른 쪽에서 실행
+
+# ASGI (myweb/asgi.py). 뷰는 이만큼의 스레드에서만 돈다. 프로세스마다 DB 연결도 이 수를 넘지 않는다.
+ASGI_THREADS = 8
+ASGI_MAX_PENDING = 200 # 스레드를 기다리는 요청이 이보다 많으면 503
+
+# 요청별 SQL/템플릿 시간 (blog/timing.py)
+SERVER_TIMING_SAMPLE_RATE = 0.01 # Server-Timing 헤더를 붙일 요청 비율. 0이면 끈다.
+SERVER_TIMING_SLOW_MS = 500 # 이보다 느린 요청은 로그(blog.timing)를 남긴다.
+SERVER_TIMING_WORST_QUERIES = 3 # 느린 요청 로그에 남길 쿼리 수
+
+# JSON API (blog/api.py)
+BLOG_API_EMBED_COMMENTS = 20 # 글 하나에 ?embed=comments로 넣는 최근 댓글 수. 나머지는 comments_url로
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': ('rest_framework.renderers.JSONRenderer',),
+    'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.URLPathVersioning',
+    'ALLOWED_VERSIONS': ('v1',),
+    'UNAUTHENTICATED_USER': None, # 인증을 쓰지 않는 API에서 AnonymousUser를 만들지 않는다.
+}
+
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_URL = '/logout/'
@@ -0,0 +1,22 @@
+import os
+
+from .settings import * # noqa
+
+
+# 라우터(blog/routers.py)를 로컬에서 확인하기 위한 SQLite 파일 두 개 구성. (MYWEB_ENV=replica)
+# 복제는 없으므로 복제본 파일은 직접 복사해서 맞춘다. 복사 후 글을 쓰면 복제 지연과 같은 상황이 된다.
+#     python manage.py migrate --settings=myweb.replica_settings
+#     cp db.sqlite3 db_replica.sqlite3
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'}, # 테스트에서는 주 DB를 그대로 본다.
+    },
+}
+
+DATABASE_REPLICAS = ['replica']
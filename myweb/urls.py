@@ -1,25 +1,34 @@
 
 from django.conf import settings
-from django.conf.urls import url
-from django.conf.urls.static import static
+from django.conf.urls import include, url
 from django.contrib import admin
 from django.contrib.auth.views import login, logout
 
 from blog import views as blog_views
+from blog import media as blog_media
 
 
 urlpatterns = [
     url(r'^$', blog_views.list_posts, name='list_posts'),
 
+    url(r'^search/$', blog_views.search_posts, name='search_posts'),
+
     url(r'^create_post/$', blog_views.create_post, name='create_post'),
     url(r'^post/(?P<pk>[0-9]+)/$', blog_views.view_post, name='view_post'),
     url(r'^post/(?P<pk>[0-9]+)/edit/$', blog_views.edit_post, name='edit_post'),
     url(r'^post/(?P<pk>[0-9]+)/delete/$', blog_views.delete_post, name='delete_post'),
+    url(r'^post/(?P<pk>[0-9]+)/comments/$', blog_views.list_comments, name='list_comments'), # 댓글 다음 페이지 조각
+    url(r'^post/(?P<pk>[0-9]+)/comments/new/$', blog_views.create_comment, name='create_comment'),
+    url(r'^post/(?P<pk>[0-9]+)/live/$', blog_views.post_events, name='post_events'), # 새 댓글 Server-Sent Events
 
     url(r'^comment/(?P<pk>[0-9]+)/delete/$', blog_views.delete_comment, name='delete_comment'),
 
     url(r'^admin/', admin.site.urls),
 
+    url(r'^api/(?P<version>v1)/', include('blog.api_urls')), # JSON API (blog/api.py)
+
+    url(r'^{}(?P<path>.+)$'.format(settings.MEDIA_URL[1:]), blog_media.serve_media, name='media'),
+
     url(r'^{}$'.format(settings.LOGIN_URL[1:]),
         login,
         {'template_name': 'login.html'},
@@ -31,8 +40,3 @@ urlpatterns = [
         name='logout_url'
     ),
 ]
-
-urlpatterns += static(
-    settings.MEDIA_URL,
-    document_root = settings.MEDIA_ROOT,
-)
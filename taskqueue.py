@@ -1,26 +1,408 @@
-
+import atexit
+import logging
+import threading
 import time
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
 
 from PIL import Image
-from celery import Celery
+from celery import Celery, Task
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myweb.settings') # celery 워커에서도 모델을 쓸 수 있도록
+
+import django
+from django.apps import apps
+from django.conf import settings
+
+if not apps.ready:
+    django.setup()
+
+logger = logging.getLogger('taskqueue')
+
+BROKER_URL = getattr(settings, 'TASKQUEUE_BROKER_URL', 'redis://localhost:6379/0')
 
 app = Celery(
     'taskqueue', # 이건 파일 이름과 같아야 한다.
-    broker='redis://localhost:6379/0',
-    backend='redis://localhost:6379/0',
+    broker=BROKER_URL,
+    backend=BROKER_URL,
 )
+# 브로커가 응답하지 않을 때 요청이 오래 붙잡히지 않도록
+app.conf.BROKER_TRANSPORT_OPTIONS = {
+    'socket_timeout': getattr(settings, 'TASKQUEUE_BROKER_TIMEOUT', 1.0),
+    'socket_connect_timeout': getattr(settings, 'TASKQUEUE_BROKER_TIMEOUT', 1.0),
+}
+
+
+'''
+태스크 실행 방식 (settings.TASKQUEUE_BACKEND)
+    'celery'  : 항상 celery 브로커로 보낸다.
+    'thread'  : 이 프로세스의 스레드 풀에서 실행한다.
+    'process' : 이 프로세스가 띄운 프로세스 풀에서 실행한다.
+    'inline'  : delay()를 부른 자리에서 바로 실행한다. (테스트용)
+    'auto'    : celery로 보내다가 브로커에 닿지 않으면 잠시 동안 스레드 풀을 쓴다.
+어느 쪽이든 호출하는 쪽은 지금처럼 task.delay(...)만 부르면 된다.
+'''
+
+_executor = None
+_executor_lock = threading.Lock()
+_broker_down_until = 0
+_connections_pid = os.getpid()
+
+
+def _reset_db_connections():
+    # 포크된 자식 프로세스는 부모의 DB 연결을 닫지 않고 버린 뒤 새로 연결한다. (프로세스마다 한 번)
+    global _connections_pid
+    if os.getpid() != _connections_pid:
+        from django.db import connections
+        connections._connections = threading.local()
+        _connections_pid = os.getpid()
+
+
+def _run_task(name, args, kwargs):
+    '''
+    로컬 풀에서 태스크를 실행한다. 프로세스 풀로도 넘길 수 있도록 태스크는 이름으로 찾는다.
+    '''
+    try:
+        return app.tasks[name](*args, **kwargs)
+    except Exception:
+        logger.exception('태스크 %s 실패', name)
+        raise
+    finally:
+        from django.db import close_old_connections
+        close_old_connections()
+
+
+def _run_task_in_child(name, args, kwargs):
+    _reset_db_connections()
+    return _run_task(name, args, kwargs)
+
+
+class LocalExecutor(object):
+    '''
+    크기가 정해진 스레드/프로세스 풀.
+    대기 중인 태스크가 max_pending개를 넘으면 submit_timeout초 동안 자리가 나길 기다리고,
+    그래도 꽉 차 있으면 부른 쪽에서 직접 실행해 (caller-runs) 큐가 끝없이 쌓이지 않게 한다.
+    '''
+    def __init__(self, kind='thread', workers=2, max_pending=100, submit_timeout=0.5):
+        if kind == 'process':
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+            self.runner = _run_task_in_child
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=workers)
+            self.runner = _run_task
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.submit_timeout = submit_timeout
+
+    def submit(self, name, args, kwargs):
+        if not self.slots.acquire(timeout=self.submit_timeout):
+            logger.warning('로컬 태스크 큐가 가득 차서 %s를 바로 실행합니다.', name)
+            try:
+                return _run_task(name, args, kwargs)
+            except Exception: # _run_task가 이미 로그를 남겼다. 태스크가 실패해도 부른 요청(create_post 등)은 성공해야 한다.
+                return None
+        future = self.pool.submit(self.runner, name, args, kwargs)
+        future.add_done_callback(lambda f: self.slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            backend = getattr(settings, 'TASKQUEUE_BACKEND', 'auto')
+            _executor = LocalExecutor(
+                kind='process' if backend == 'process' else 'thread',
+                workers=getattr(settings, 'TASKQUEUE_WORKERS', 2),
+                max_pending=getattr(settings, 'TASKQUEUE_MAX_PENDING', 100),
+                submit_timeout=getattr(settings, 'TASKQUEUE_SUBMIT_TIMEOUT', 0.5),
+            )
+        return _executor
+
+
+@atexit.register
+def shutdown(wait=True):
+    '''
+    로컬 풀에 남은 태스크를 끝까지 실행하고 닫는다. 프로세스가 끝날 때 자동으로 불린다.
+    '''
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def dispatch(task, args=(), kwargs=None):
+    global _broker_down_until
+    kwargs = kwargs or {}
+    backend = getattr(settings, 'TASKQUEUE_BACKEND', 'auto')
+
+    if backend == 'inline':
+        return task(*args, **kwargs)
+    if backend == 'celery':
+        return task.apply_async(args, kwargs)
+    if backend == 'auto' and time.time() >= _broker_down_until:
+        try:
+            return task.apply_async(args, kwargs, retry=False)
+        except Exception as e: # 브로커에 닿지 않으면 한동안은 시도하지 않고 로컬 풀을 쓴다.
+            _broker_down_until = time.time() + getattr(settings, 'TASKQUEUE_BROKER_RETRY', 30)
+            logger.warning('브로커에 연결할 수 없어 로컬 풀에서 실행합니다: %s', e)
+    return get_executor().submit(task.name, args, kwargs)
+
+
+class DispatchTask(Task):
+    abstract = True
+
+    def delay(self, *args, **kwargs):
+        return dispatch(self, args, kwargs)
+
+    def __call__(self, *args, **kwargs):
+        from blog.routers import clean_state
+        # 워커 스레드/프로세스는 태스크를 이어서 실행하므로 앞 태스크의 쓰기 기록(읽기를 주 DB로)을 넘기지 않는다.
+        with clean_state():
+            return super(DispatchTask, self).__call__(*args, **kwargs)
+
+# 원본 확장자별로 PIL 저장 포맷
+SAVE_FORMATS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.gif': 'GIF',
+    '.webp': 'WEBP',
+}
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+}
+
 
-@app.task
-def make_thumbnail(path, width, height):
+def thumbnail_sizes():
+    return sorted(getattr(settings, 'BLOG_THUMBNAIL_SIZES', (320, 640, 1024, 1600)), reverse=True)
+
+
+def thumbnail_formats(ext):
+    '''
+    원본 포맷과 (설정돼 있고 PIL이 지원하면) WebP로 저장한다.
+    '''
+    formats = [SAVE_FORMATS.get(ext.lower(), 'JPEG')]
+    Image.init() # WebP 플러그인은 Pillow가 libwebp와 함께 빌드됐을 때만 등록된다.
+    if getattr(settings, 'BLOG_THUMBNAIL_WEBP', True) and 'WEBP' in Image.SAVE and 'WEBP' not in formats:
+        formats.append('WEBP')
+    return formats
+
+
+def variant_path(path, width, fmt):
     filepath, ext = os.path.splitext(path) # 파일의 경로와 파일의 확장자를 분류한다. ('jake', '.jpg')
-    output_path = '{}_thumb{}'.format(filepath, ext)
+    if fmt == 'WEBP' and ext.lower() != '.webp':
+        ext = '.webp'
+    return '{}_w{}{}'.format(filepath, width, ext)
+
+
+def expected_variants(path, width, sizes=None):
+    '''
+    원본 너비가 width일 때 만들어져야 하는 축소본 파일 경로들
+    '''
+    ext = os.path.splitext(path)[1]
+    return [
+        variant_path(path, w, fmt)
+        for w in (sizes or thumbnail_sizes()) if w < width
+        for fmt in thumbnail_formats(ext)
+    ]
+
+
+class ImageTooLarge(ValueError):
+    '''
+    사진이 BLOG_IMAGE_MAX_PIXELS / BLOG_IMAGE_MAX_BYTES를 넘는다. (압축 폭탄)
+    '''
+
+
+def check_image_budget(width, height, nbytes=None):
+    '''
+    디코딩하기 전에 (헤더만 읽고) 픽셀 수와 파일 크기를 확인한다.
+    '''
+    max_pixels = getattr(settings, 'BLOG_IMAGE_MAX_PIXELS', 40 * 1000 * 1000)
+    max_bytes = getattr(settings, 'BLOG_IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge('{}x{} 사진은 {} 픽셀을 넘습니다.'.format(width, height, max_pixels))
+    if max_bytes and nbytes is not None and nbytes > max_bytes:
+        raise ImageTooLarge('{} 바이트 사진은 {} 바이트를 넘습니다.'.format(nbytes, max_bytes))
+
+
+# EXIF Orientation(274) 값별로 바로 세우는 변환
+ORIENTATION_TAG = 274
+ORIENTATION_TRANSPOSE = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.ROTATE_90, Image.FLIP_TOP_BOTTOM), # Image.TRANSPOSE
+    6: (Image.ROTATE_270,),
+    7: (Image.ROTATE_270, Image.FLIP_TOP_BOTTOM), # Image.TRANSVERSE
+    8: (Image.ROTATE_90,),
+}
+
+
+def exif_orientation(im):
+    try:
+        exif = im._getexif() if hasattr(im, '_getexif') else None # JPEG만 EXIF를 읽는다.
+    except Exception: # 깨진 EXIF는 무시하고 그대로 둔다.
+        return 1
+    orientation = (exif or {}).get(ORIENTATION_TAG, 1)
+    return orientation if orientation in ORIENTATION_TRANSPOSE else 1
+
+
+def _image_bytes(im):
+    # PIL은 1/L/P는 픽셀당 1바이트, 나머지(RGB 포함)는 4바이트로 들고 있다.
+    return im.size[0] * im.size[1] * (1 if im.mode in ('1', 'L', 'P') else 4)
+
+
+@contextmanager
+def open_upright(path, widths=()):
+    '''
+    사진을 바로 세워서 디코딩한다. (im, width, height, stats)를 넘겨준다.
+        - 디코딩 전에 픽셀 수와 파일 크기를 확인한다. (check_image_budget)
+        - JPEG는 draft로 widths 중 원본보다 작은 가장 큰 너비보다 작아지지 않는 1/2, 1/4, 1/8 크기로 바로 디코딩한다.
+        - EXIF 방향은 줄어든 이미지에서 돌린다. width, height는 바로 세운 원본 크기다.
+    stats에는 디코딩 시간과 이미지 버퍼의 바이트 수(어림값)를 남긴다. 더 줄이는 쪽에서 peak_bytes를 이어서 갱신한다.
+    '''
+    nbytes = os.path.getsize(path)
+    source = im = Image.open(path)
+    try:
+        check_image_budget(im.size[0], im.size[1], nbytes)
+        orientation = exif_orientation(im)
+        rotated = orientation in (5, 6, 7, 8) # 세로로 돌려야 하면 저장된 가로/세로가 바뀐다.
+        width, height = (im.size[1], im.size[0]) if rotated else im.size
+        wanted = [w for w in widths if w < width]
+
+        if wanted: # 가장 큰 축소본보다 작아지지 않는 범위에서 디코딩 크기를 줄인다.
+            scale = max(wanted) / float(width)
+            box = (int(im.size[0] * scale) or 1, int(im.size[1] * scale) or 1)
+            im.draft(im.mode, box) # JPEG가 아니면 아무 일도 하지 않는다.
+        load_started = time.time()
+        im.load()
+        stats = {
+            'decode_ms': round((time.time() - load_started) * 1000, 1),
+            'draft_scale': round((im.size[1] if rotated else im.size[0]) / float(width), 3),
+            'peak_bytes': _image_bytes(im),
+        }
+
+        for method in ORIENTATION_TRANSPOSE.get(orientation, ()):
+            im = im.transpose(method)
+        if im.mode not in ('RGB', 'RGBA', 'L'):
+            im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+        yield im, width, height, stats
+    finally:
+        source.close() # 파일은 원본 이미지가 들고 있다.
+
+
+def _save_replacing(im, output_path, fmt):
+    # 서빙 중인 축소본을 제자리에서 다시 쓰지 않는다. 같은 폴더의 임시 파일에 쓰고 한 번에 바꿔 넣는다. (blog/resize.py와 같다)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            im.save(f, fmt, quality=getattr(settings, 'BLOG_THUMBNAIL_QUALITY', 85))
+        os.replace(tmp_path, output_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def render_thumbnails(path, sizes=None):
+    '''
+    원본을 한 번만 디코딩해서 너비별(sizes) 축소본을 원본 포맷과 WebP로 만든다.
+    원본보다 큰 너비는 만들지 않는다. 원본보다 새 파일이 이미 있으면 다시 만들지 않는다.
+    반환값은 원본 크기와 만든 파일 목록이다.
+    celery 없이도 부를 수 있도록 (backfill_thumbnails의 프로세스 풀) 태스크와 분리해 둔다.
+    디코딩은 open_upright가 메모리를 아껴서 한다. stats에 디코딩 시간과 최대 버퍼 크기를 남긴다.
+    '''
+    started = time.time()
+    sizes = sorted(sizes or thumbnail_sizes(), reverse=True)
+    ext = os.path.splitext(path)[1]
+    formats = thumbnail_formats(ext)
+
+    source_mtime = os.path.getmtime(path)
+    variants = []
+    with open_upright(path, sizes) as (im, width, height, stats):
+        for w in sizes: # 큰 것부터 줄여가면서 바로 전 단계 결과를 다시 줄인다.
+            if w >= width:
+                continue
+            h = max(1, int(round(height * w / float(width))))
+            resized = im.resize((w, h), Image.ANTIALIAS) # ANTIALIAS는 튀는 부분을 막아준다..(검색해봐야지)
+            stats['peak_bytes'] = max(stats['peak_bytes'], _image_bytes(im) + _image_bytes(resized))
+            im = resized
+            for fmt in formats:
+                output_path = variant_path(path, w, fmt)
+                if not os.path.exists(output_path) or os.path.getmtime(output_path) < source_mtime:
+                    out = im
+                    if fmt == 'JPEG' and out.mode != 'RGB':
+                        out = out.convert('RGB')
+                    _save_replacing(out, output_path, fmt)
+                variants.append({
+                    'path': output_path,
+                    'width': w,
+                    'height': h,
+                    'type': MIME_TYPES[fmt],
+                })
+
+    stats['total_ms'] = round((time.time() - started) * 1000, 1)
+    logger.info('축소본 %s: %dx%d 디코딩 %.1fms (x%.3f) 전체 %.1fms 최대 버퍼 %d바이트',
+                path, width, height, stats['decode_ms'], stats['draft_scale'], stats['total_ms'],
+                stats['peak_bytes'])
+    return {'width': width, 'height': height, 'variants': variants, 'stats': stats}
+
+
+@app.task(base=DispatchTask)
+def make_thumbnail(path, sizes=None):
+    return render_thumbnails(path, sizes)
+
+
+@app.task(base=DispatchTask)
+def make_post_thumbnails(post_pk):
+    '''
+    글 사진의 축소본들을 만들고 글에 기록한다. 템플릿은 이 기록으로 srcset을 만든다.
+    '''
+    from blog.models import Post
+    from blog.routers import use_primary
+
+    with use_primary(): # 방금 만든 글이라 복제본에는 아직 없을 수 있다.
+        post = Post.objects.filter(pk=post_pk).first()
+    if post is None or not post.photo: # 그 사이에 글이 지워졌거나 사진이 없으면 할 일이 없다.
+        return None
+    result = render_thumbnails(post.photo.path)
+    post.set_photo_variants(result)
+    post.save(update_fields=['photo_variants', 'updated_at']) # srcset이 바뀌었으므로 글 보기의 Last-Modified도 올린다.
+    return post.photo_variants
+
 
-    if os.path.exists(output_path):
-        return output_path
+@app.task(base=DispatchTask)
+def delete_photo_files(groups, scheduled_at=None):
+    '''
+    groups: [[원본 이름, [축소본 이름, ...]], ...] (blog.cleanup이 모아서 보낸다)
+    지우는 시점에 아직 그 원본을 쓰는 글이 있으면 (같은 사진을 올린 다른 글) 그 묶음은 건너뛴다.
+    scheduled_at(예약한 시각) 뒤에 같은 사진이 다시 올라왔으면 (아직 글이 저장되기 전) 그 묶음도 건너뛴다.
+    '''
+    from blog.models import Post
+    from blog.routers import use_primary
 
-    im = Image.open(path)
-    im.thumbnail((width, height, ), Image.ANTIALIAS) # ANTIALIAS는 튀는 부분을 막아준다..(검색해봐야지)
-    im.save(output_path)
-    im.close()
-    return output_path
+    storage = Post._meta.get_field('photo').storage
+    with use_primary():
+        in_use = set(Post.objects.filter(photo__in=[name for name, _ in groups]).values_list('photo', flat=True))
+    deleted = 0
+    for name, derivatives in groups:
+        if name in in_use:
+            continue
+        if scheduled_at is not None and storage.reused_since(name, scheduled_at):
+            continue
+        storage.clear_reused(name)
+        for filename in [name] + list(derivatives):
+            if storage.exists(filename):
+                storage.delete(filename)
+                deleted += 1
+    return deleted